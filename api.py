@@ -1,17 +1,32 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, model_validator
+from typing import List, Optional
+import datetime
+import json
 import logging
-from backend.pipeline import BusinessAssistant
-from openai import OpenAI
+import time
 import pandas as pd
+from backend.pipeline import BusinessAssistant
+from backend.dataset import get_dataset, reload_dataset
+from backend.rollups import merchant_kpis, warm_rollups
+from backend.workers import QueueFullError, causal_pool
+from backend.sandbox import sandbox_pool
+from backend.assistant import assistant_pool
+from backend.llm import achat, aclose, astream_chat, load_encodings
+from backend.llm_usage import usage
+from backend.metrics import Gauge, RequestIdFilter, registry, request_seconds, requests_in_flight
+from backend.eda import EDA_BASELINE_DAYS, budgeted_summary
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; every record carries the X-Request-ID of the request it belongs to
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(request_id)s] %(message)s")
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RequestIdFilter())
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -24,6 +39,58 @@ app = FastAPI(
 # Initialize the BusinessAssistant
 business_assistant = BusinessAssistant()
 
+# Pool queue depths, read when /metrics is scraped
+registry.register(Gauge("causal_pool_pending", "Causal attribution jobs running or waiting for a worker",
+                        lambda: causal_pool.pending))
+registry.register(Gauge("sandbox_pool_idle_workers", "Sandbox workers free to run a snippet",
+                        lambda: sandbox_pool.idle))
+registry.register(Gauge("sandbox_pool_waiting", "Snippets waiting for a free sandbox worker",
+                        lambda: sandbox_pool.waiting))
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Collect the LLM calls made for each request under its X-Request-ID
+    (generated when absent) and record its latency and in-flight count
+    """
+    started = time.perf_counter()
+    status = 500
+    requests_in_flight.inc()
+    try:
+        with usage.trace(request_id=request.headers.get("X-Request-ID"), path=request.url.path) as trace:
+            response = await call_next(request)
+            status = response.status_code
+            logger.info(f"{request.method} {request.url.path} {status} in {(time.perf_counter() - started) * 1000:.0f}ms")
+    finally:
+        requests_in_flight.dec()
+        # Label by route template, not raw path, so the series stay bounded
+        route = request.scope.get("route")
+        request_seconds.observe(time.perf_counter() - started, request.method,
+                                route.path if route is not None else "unmatched", status)
+    response.headers["X-Request-ID"] = trace.request_id
+    return response
+
+@app.on_event("startup")
+async def load_dataset():
+    """Parse the transaction dataset once, before the first request arrives"""
+    handle = get_dataset()
+    logger.info(f"Loaded dataset v{handle.version}: {handle.rows} rows from {handle.path}")
+    warm_rollups(handle)
+    # The first use of a tiktoken encoding may download it; not on a request
+    await run_in_threadpool(load_encodings)
+    # The sandbox zygote loads its own copy of the dataset and forks the workers
+    if sandbox_pool.size > 0:
+        await run_in_threadpool(sandbox_pool.start)
+    if causal_pool.max_workers > 0:
+        await run_in_threadpool(causal_pool.start)
+
+@app.on_event("shutdown")
+async def stop_workers():
+    causal_pool.shutdown()
+    sandbox_pool.shutdown()
+    await run_in_threadpool(assistant_pool.shutdown)
+    await aclose()
+
 # Pydantic models for request/response
 class QueryRequest(BaseModel):
     question: str
@@ -34,10 +101,40 @@ class QueryResponse(BaseModel):
     response: str
     success: bool
     error: Optional[str] = None
+    # Causal questions only: per-KPI scores, confidence intervals and sample count
+    attribution: Optional[List[dict]] = None
+
+
+class BatchQueryRequest(BaseModel):
+    items: List[QueryRequest]
+
+class BatchQueryResult(BaseModel):
+    question: str
+    merchant: str
+    classification: Optional[str] = None
+    response: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+    attribution: Optional[List[dict]] = None
+    elapsed_ms: float
+    deduplicated: bool = False
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+    elapsed_ms: float
 
 
 class CardsDataRequest(BaseModel):
     merchant: str
+    # Inclusive ISO dates; malformed dates or an inverted window answer 422
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+
+    @model_validator(mode="after")
+    def check_window(self):
+        if self.start_date and self.end_date and self.start_date > self.end_date:
+            raise ValueError("start_date must not be after end_date")
+        return self
 
 class CardsDataResponse(BaseModel):
     totalTransactions: float
@@ -51,16 +148,17 @@ class BusinessInsightsResponse(BaseModel):
 class BusinessInsightsRequest(BaseModel):
     merchant: str
 
-@app.post("/business-insights", response_model=BusinessInsightsResponse)
-async def get_business_insights(request: BusinessInsightsRequest):
-    # Initialize OpenAI client
-    client = OpenAI()
-
-    # Craft a prompt for analyzing sample 2 data
-    data = pd.read_csv('data/data_cleaned.csv')
-    merchant = request.merchant
-    df = data[data['Merchant Display Name'] == merchant]
-    sample2_summary = df[df['Date'] == '2025-05-10']
+BUSINESS_INSIGHTS_SYSTEM_PROMPT = "You are a business intelligence analyst providing insights on payment transaction patterns."
+BUSINESS_INSIGHTS_OPTIONS = {"model": "gpt-4o", "temperature": 0.7, "max_tokens": 1000}
+
+
+def business_insights_prompt(merchant):
+    """Craft a prompt for analyzing sample 2 data from a token-budgeted EDA summary"""
+    # Only the analysed day and its baseline window are loaded
+    day = pd.Timestamp('2025-05-10')
+    df = get_dataset().merchant(merchant, start=day - pd.Timedelta(days=EDA_BASELINE_DAYS), end=day)
+    sample2_summary, tokens = budgeted_summary(df, day, model=BUSINESS_INSIGHTS_OPTIONS["model"])
+    logger.info(f"EDA summary for {merchant}: {tokens} tokens")
     analysis_prompt = f"""You are a business intelligence analyst specializing in payment systems and transaction analysis.
 
     Do not include any recommendations. JUST SIMPLE EDA ANALYSIS
@@ -76,51 +174,56 @@ async def get_business_insights(request: BusinessInsightsRequest):
     Please structure your response in clear sections and avoid technical jargon, as this will be presented to senior business stakeholders.
     Do not include a seperate section for conclusion or summary or anything like that.
     """
+    return analysis_prompt
 
-    # Make the API call
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a business intelligence analyst providing insights on payment transaction patterns."},
-            {"role": "user", "content": analysis_prompt}
-        ],
-        temperature=0.7,
-        max_tokens=1000
-    )
-    response = str(response.choices[0].message.content)
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/business-insights", response_model=BusinessInsightsResponse)
+async def get_business_insights(request: BusinessInsightsRequest):
+    # Loading the slice and summarising it is blocking work; keep it off the event loop
+    analysis_prompt = await run_in_threadpool(business_insights_prompt, request.merchant)
+
+    # Make the API call through the shared async client
+    response = await achat(BUSINESS_INSIGHTS_SYSTEM_PROMPT, analysis_prompt, stage="business_insights", **BUSINESS_INSIGHTS_OPTIONS)
+    response = str(response)
     return BusinessInsightsResponse(insights=response)
+
+
+@app.post("/business-insights/stream")
+async def stream_business_insights(request: BusinessInsightsRequest):
+    """Server-sent events: a 'stage' event once the data is summarised, then the insights token by token"""
+    async def events():
+        try:
+            analysis_prompt = await run_in_threadpool(business_insights_prompt, request.merchant)
+            yield sse_event("stage", {"stage": "summarised"})
+            async for token in astream_chat(BUSINESS_INSIGHTS_SYSTEM_PROMPT, analysis_prompt, stage="business_insights", **BUSINESS_INSIGHTS_OPTIONS):
+                yield sse_event("token", token)
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.error(f"Error streaming business insights: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
     
 
 @app.post("/get-cards-data", response_model=CardsDataResponse)
 async def get_cards_data(request: CardsDataRequest):
     # Specify the merchant type (e.g., 'Merchant A')
     merchant_type = request.merchant
-    
-    import pandas as pd
-    df = pd.read_csv('data/data_cleaned.csv')
 
-    # Filter data for the given merchant type
-    df_merchant = df[df['Merchant Display Name'] == merchant_type]
+    # Counts and sums come from the merchant x date rollup, so only the days
+    # in the requested window are touched
+    kpis = merchant_kpis(merchant_type, request.start_date, request.end_date)
 
     # Insight 1: Total number of transactions
-    total_transactions = df_merchant.shape[0]
-
     # Insight 2: Total refund amount
-    total_refund_amount = abs(df_merchant['Refund Amount'].sum())
-
     # Insight 3: Average settlement amount per transaction
-    average_settlement_amount = df_merchant['Settlement Amount'].mean()
-
     # Insight 4: Success rate (proportion of captured transactions)
-    success_rate = (df_merchant['Transaction Status Name'] == 'CAPTURED').mean()
-
-    # Assemble insights into a DataFrame for display
-    insights = CardsDataResponse(
-        totalTransactions=total_transactions,
-        totalRefundAmount=total_refund_amount,
-        averageSettlementAmount=average_settlement_amount,
-        successRate=success_rate
-    )
+    insights = CardsDataResponse(**kpis)
 
     return insights
 
@@ -129,6 +232,31 @@ async def root():
     """Health check endpoint"""
     return {"message": "Business Assistant API is running", "status": "healthy"}
 
+@app.post("/admin/reload-dataset")
+async def reload_dataset_endpoint():
+    """Re-read data/data_cleaned.csv and publish it as a new dataset version"""
+    handle = await run_in_threadpool(reload_dataset)
+    await run_in_threadpool(warm_rollups, handle)
+    if sandbox_pool.running:
+        await run_in_threadpool(sandbox_pool.restart)
+    logger.info(f"Reloaded dataset v{handle.version}: {handle.rows} rows")
+    return {"version": handle.version, "rows": handle.rows}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, request latency, in-flight requests and pool queue depths"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/llm/usage")
+async def llm_usage():
+    """Calls, cache hits, tokens and latency percentiles of LLM calls per stage and model"""
+    return usage.stats()
+
+@app.get("/llm/traces")
+async def llm_traces(limit: int = 50):
+    """LLM calls of the most recent requests, newest first"""
+    return usage.traces(limit)
+
 @app.post("/query", response_model=QueryResponse)
 async def run_assistant_query(request: QueryRequest):
     """
@@ -143,9 +271,17 @@ async def run_assistant_query(request: QueryRequest):
     # try:
     logger.info(f"Processing query: {request.question}")
     
-    # Run the query through the assistant
-    response = business_assistant.query(request.question, request.merchant)
+    # Run the query through the assistant; the causal stage runs in the process pool
+    try:
+        answer = await business_assistant.answer(
+            request.question,
+            request.merchant,
+            causal_pool=causal_pool if causal_pool.max_workers > 0 else None,
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
+    response, attribution = answer["response"], answer["attribution"]
     if response is None:
         raise HTTPException(status_code=500, detail="Assistant returned no response")
     
@@ -154,7 +290,8 @@ async def run_assistant_query(request: QueryRequest):
     return QueryResponse(
         question=request.question,
         response=response,
-        success=True
+        success=True,
+        attribution=[result.as_dict() for result in attribution] if attribution is not None else None,
     )
     
     # except Exception as e:
@@ -166,6 +303,51 @@ async def run_assistant_query(request: QueryRequest):
     #         error=str(e)
     #     )
 
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def run_assistant_query_batch(request: BatchQueryRequest):
+    """
+    Run several business queries in one request.
+
+    Identical (question, merchant) pairs are answered once, questions are
+    classified in a single LLM call, and the answers are computed concurrently
+    (BATCH_MAX_CONCURRENCY). Results are returned per item, in order, with timing.
+    """
+    start = time.perf_counter()
+    logger.info(f"Processing batch of {len(request.items)} queries")
+    results = await business_assistant.aquery_batch(
+        [(item.question, item.merchant) for item in request.items],
+        causal_pool=causal_pool if causal_pool.max_workers > 0 else None,
+    )
+    return BatchQueryResponse(
+        results=[BatchQueryResult(**result) for result in results],
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+    )
+
+@app.post("/query/stream")
+async def stream_assistant_query(request: QueryRequest):
+    """
+    Streaming variant of /query as server-sent events.
+
+    Emits 'stage' events as classification, KPI extraction, attribution or code
+    execution complete, then 'token' events with the narrative as the LLM writes
+    it, and finally 'done' (or 'error').
+    """
+    logger.info(f"Streaming query: {request.question}")
+
+    async def events():
+        try:
+            async for event, data in business_assistant.stream_query(
+                request.question,
+                request.merchant,
+                causal_pool=causal_pool if causal_pool.max_workers > 0 else None,
+            ):
+                yield sse_event(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # Error handlers
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
@@ -1,17 +1,36 @@
+import logging
 import os
+import queue
+import threading
 import time
-from openai import OpenAI
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from .dataset import get_dataset
+from .llm import count_tokens, get_client
+from .llm_usage import LLMCall, usage
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Long-lived assistants kept by AssistantPool (questions beyond this wait for one)
+ASSISTANT_POOL_SIZE = int(os.environ.get("ASSISTANT_POOL_SIZE", 2))
+# Run polling starts at the initial interval and doubles up to the maximum
+ASSISTANT_POLL_INITIAL_SECONDS = float(os.environ.get("ASSISTANT_POLL_INITIAL_SECONDS", 0.1))
+ASSISTANT_POLL_MAX_SECONDS = float(os.environ.get("ASSISTANT_POLL_MAX_SECONDS", 1.0))
+
+
 class DataAnalysisAssistant:
-    def __init__(self):
+    def __init__(self, poll_initial=ASSISTANT_POLL_INITIAL_SECONDS, poll_max=ASSISTANT_POLL_MAX_SECONDS):
         """Initialize the OpenAI client and create an assistant"""
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.client = get_client(os.environ.get("OPENAI_API_KEY"))
         self.assistant = None
         self.thread = None
         self.file_id = None
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
         
     def create_assistant(self):
         """Create an assistant with code interpreter capabilities"""
@@ -55,6 +74,30 @@ class DataAnalysisAssistant:
             print(f"❌ Error creating thread: {e}")
             return None
     
+    def delete_thread(self):
+        """Delete the conversation thread"""
+        if self.thread is None:
+            return
+        try:
+            self.client.beta.threads.delete(self.thread.id)
+        except Exception as e:
+            print(f"⚠️ Error deleting thread: {e}")
+        self.thread = None
+
+    def wait_for_run(self, run, show_steps=False):
+        """Poll a run until it leaves queued/in_progress, backing off from poll_initial to poll_max"""
+        interval = self.poll_initial
+        while run.status in ['queued', 'in_progress']:
+            time.sleep(interval)
+            interval = min(interval * 2, self.poll_max)
+            run = self.client.beta.threads.runs.retrieve(
+                thread_id=self.thread.id,
+                run_id=run.id
+            )
+            if show_steps:
+                print(f"🔄 Status: {run.status}")
+        return run
+
     def ask_question(self, question, include_file=True, show_steps=True):
         """Ask a question about the uploaded data and optionally show intermediate steps"""
         if not self.thread or not self.assistant:
@@ -82,21 +125,26 @@ class DataAnalysisAssistant:
             message = self.client.beta.threads.messages.create(**message_data)
             
             # Run the assistant
+            started = time.perf_counter()
             run = self.client.beta.threads.runs.create(
                 thread_id=self.thread.id,
                 assistant_id=self.assistant.id
             )
             
             # Wait for completion and show progress
-            while run.status in ['queued', 'in_progress']:
-                time.sleep(1)
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=self.thread.id,
-                    run_id=run.id
-                )
-                if show_steps:
-                    print(f"🔄 Status: {run.status}")
+            run = self.wait_for_run(run, show_steps)
             
+            run_usage = getattr(run, "usage", None)
+            usage.record(LLMCall(
+                stage="assistant",
+                model=getattr(run, "model", None) or "gpt-4o",
+                latency_ms=(time.perf_counter() - started) * 1000,
+                prompt_tokens_est=count_tokens(question),
+                prompt_tokens=getattr(run_usage, "prompt_tokens", None),
+                completion_tokens=getattr(run_usage, "completion_tokens", None),
+                error=None if run.status == 'completed' else run.status,
+            ))
+
             if run.status == 'completed':
                 # Show intermediate steps if requested
                 if show_steps:
@@ -199,3 +247,153 @@ class DataAnalysisAssistant:
             print(f"⚠️ Error during cleanup: {e}")
 
 
+class AssistantPool:
+    """
+    Long-lived code-interpreter assistants shared by all questions.
+
+    Up to `size` assistants are created on first use and reused; the dataset
+    file is uploaded once per dataset version. The upload of a superseded
+    version is deleted once no run is using it any more. Each question only
+    gets its own thread, which is deleted once it is answered.
+    """
+    def __init__(self, size=ASSISTANT_POOL_SIZE):
+        self.size = size
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = []
+        self._creating = 0  # assistants being created outside the lock
+        self._uploads = {}  # dataset key -> (dataset version, Future of the file id)
+        self._users = Counter()  # file id -> runs using it
+        self._retired = set()  # superseded file ids, deleted once unused
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow an idle assistant, creating one while fewer than `size` exist.
+        The lock only reserves the slot and publishes the new assistant; the
+        API call creating it runs outside it.
+        """
+        with self._lock:
+            create = self._idle.empty() and len(self._created) + self._creating < self.size
+            if create:
+                self._creating += 1
+        if create:
+            analyzer = None
+            try:
+                analyzer = DataAnalysisAssistant()
+                if analyzer.create_assistant() is None:
+                    raise RuntimeError("Could not create assistant")
+            finally:
+                with self._lock:
+                    self._creating -= 1
+                    if analyzer is not None and analyzer.assistant is not None:
+                        self._created.append(analyzer)
+        else:
+            analyzer = self._idle.get()
+        try:
+            yield analyzer
+        finally:
+            self._idle.put(analyzer)
+
+    @contextmanager
+    def dataset_file(self, analyzer, handle):
+        """
+        ID of the uploaded dataset file for `handle`, kept alive for the block.
+
+        The first caller for a dataset version uploads it outside the pool
+        lock; concurrent callers for the same version wait for that upload.
+        """
+        file_id = self._acquire(analyzer, handle)
+        try:
+            yield file_id
+        finally:
+            with self._lock:
+                self._users[file_id] -= 1
+                unused = self._unused_retired()
+            self._delete(analyzer, unused)
+
+    def _acquire(self, analyzer, handle):
+        while True:
+            key = handle.fingerprint or handle.version
+            with self._lock:
+                version, future = self._uploads.get(key, (handle.version, None))
+                uploader = future is None
+                if uploader:
+                    future = Future()
+                    self._uploads[key] = (version, future)
+            if uploader:
+                self._upload(analyzer, handle, key, future)
+            file_id = future.result()
+            with self._lock:
+                if self._uploads.get(key, (None, None))[1] is future:
+                    self._users[file_id] += 1
+                    return file_id
+            # A newer dataset version was uploaded in the meantime; use it instead
+            handle = get_dataset()
+
+    def _upload(self, analyzer, handle, key, future):
+        file_id = analyzer.upload_file(handle.path)
+        with self._lock:
+            if file_id is None:
+                self._uploads.pop(key, None)
+                future.set_exception(RuntimeError(f"Could not upload {handle.path}"))
+                return
+            future.set_result(file_id)
+            # Only the latest uploaded version stays; older ones are retired
+            done = {k: (version, f.result()) for k, (version, f) in self._uploads.items() if f.done()}
+            latest = max(done, key=lambda k: done[k][0], default=None)
+            for k, (_, old_id) in done.items():
+                if k != latest:
+                    del self._uploads[k]
+                    self._retired.add(old_id)
+            if latest is None:
+                # The pool was shut down during the upload
+                self._retired.add(file_id)
+            unused = self._unused_retired()
+        self._delete(analyzer, unused)
+
+    def _unused_retired(self):
+        """Pop the retired file ids no run is using any more (call with the lock held)"""
+        unused = {file_id for file_id in self._retired if not self._users[file_id]}
+        self._retired -= unused
+        for file_id in unused:
+            del self._users[file_id]
+        return unused
+
+    def _delete(self, analyzer, file_ids):
+        for file_id in file_ids:
+            try:
+                analyzer.client.files.delete(file_id)
+            except Exception as e:
+                logger.warning(f"Could not delete dataset upload {file_id}: {e}")
+
+    def ask(self, question, show_steps=False):
+        """Answer a question about the current dataset on a fresh thread of a pooled assistant"""
+        handle = get_dataset()
+        with self.session() as analyzer, self.dataset_file(analyzer, handle) as file_id:
+            analyzer.file_id = file_id
+            if analyzer.create_thread() is None:
+                return None
+            try:
+                return analyzer.ask_question(question, show_steps=show_steps)
+            finally:
+                analyzer.delete_thread()
+
+    def shutdown(self):
+        """Delete the pooled assistants and the uploaded dataset files"""
+        with self._lock:
+            created, self._created = self._created, []
+            uploads, self._uploads = self._uploads, {}
+            uploaded = {f.result() for _, f in uploads.values() if f.done()} | self._retired
+            self._retired = set()
+            self._users.clear()
+        for analyzer in created:
+            analyzer.file_id = None
+            analyzer.cleanup()
+        if created:
+            self._delete(created[0], uploaded)
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+
+assistant_pool = AssistantPool()
@@ -0,0 +1,62 @@
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Raw acquirer column and the precomputed, normalized bank column derived from it.
+# data_cleaned.csv has no acquirer name column (only the response code and the
+# issuer match flag), so none is assumed: set ACQUIRER_COLUMN to the column
+# holding acquirer names in exports that have one
+ACQUIRER_COLUMN = os.environ.get("ACQUIRER_COLUMN", "")
+BANK_COLUMN = "Acquirer Bank"
+
+# Bank mapping utilities
+BANK_TOKENS = {
+    "AXIS": "AXIS", 
+    "HDFC": "HDFC", 
+    "KOTAK": "KOTAK",
+    "ICICI": "ICICI", 
+    "INDUSIND": "INDUSIND_BANK", 
+    "RBL": "RBL",
+    "SCB": "STANDARD_CHARTERED_BANK", 
+    "YES": "YES",
+    "PNB": "PNB", 
+    "IOB": "INDIAN_OVERSEAS_BANK"
+}
+
+
+@lru_cache(maxsize=4096)
+def map_acquirer(acq):
+    """Map acquirer names to standardized bank tokens (memoized per raw value)."""
+    s = re.sub(r"[^A-Z]", "", str(acq).upper())
+    for k, v in BANK_TOKENS.items():
+        if k in s:
+            return v
+    return "OTHER"
+
+
+def map_acquirer_series(values):
+    """
+    Vectorized map_acquirer: each distinct raw value is mapped once and the
+    result is returned as a categorical Series aligned with `values`.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    mapped = [map_acquirer(u) for u in uniques]
+    categories = sorted(set(mapped) | {"OTHER"})
+    positions = pd.Index(categories).get_indexer(mapped)
+    # factorize marks missing values with -1; str(nan) maps to "OTHER" too
+    bank_codes = np.where(codes >= 0, positions[codes] if len(positions) else -1, categories.index("OTHER"))
+    return pd.Series(pd.Categorical.from_codes(bank_codes, categories=categories), index=values.index)
+
+
+def add_bank_column(frame):
+    """Add the normalized `Acquirer Bank` column when the raw acquirer column exists"""
+    if ACQUIRER_COLUMN and ACQUIRER_COLUMN in frame.columns:
+        frame[BANK_COLUMN] = map_acquirer_series(frame[ACQUIRER_COLUMN])
+    return frame
@@ -0,0 +1,503 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from dowhy import gcm
+from dowhy.gcm.causal_models import PARENTS_DURING_FIT, clone_causal_models
+from dowhy.gcm.distribution_change import mechanism_change_test
+from dowhy.gcm.fitting_sampling import fit_causal_model_of_target
+from dowhy.gcm.shapley import ShapleyConfig, estimate_shapley_values
+from dowhy.graph import get_ordered_predecessors, is_root_node, node_connected_subgraph_view
+from dotenv import load_dotenv
+from statsmodels.stats.multitest import multipletests
+
+from .metrics import timed
+from .workers import CAUSAL_WORKERS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Edges of the causal DAG, based on the whiteboard diagram
+CAUSAL_EDGES = [
+    ("Acquirer Issuer Match", "Refund Amount"),
+    ("Payment Mode Name", "Refund Amount"),
+    ("Transaction Status Name", "Refund Amount"),
+    ("Acquirer Response Code", "Refund Amount"),
+    ("Time To Complete", "Refund Amount"),
+    # ("Pine Payment Gateway Integration Mode Name", "Refund Amount"),
+
+    ("Refund Amount", "Settlement Amount"),
+
+    ("Bank Commision", "Settlement Amount"),
+    # ("Convenience Fees Amount In (Paise)", "settlement_amount"),
+    ("Amount To Be Deducted In Addition To Bank Charges", "Settlement Amount"),
+    ("Bank Service Tax", "Settlement Amount"),
+]
+
+# KPI nodes of the DAG that causal questions can ask about
+CAUSAL_KPIS = ["Refund Amount", "Settlement Amount"]
+
+# Encode non-numeric columns except date
+CATEGORICAL_COLUMNS = ['Payment Mode Name', 'Transaction Status Name', 'Acquirer Response Code', 'Acquirer Issuer Match', 'Payout Status']
+
+DROPPED_COLUMNS = ['Convenience Fees Amount In (Paise)', 'Pine Payment Gateway Integration Mode Name']
+
+# Columns the causal stage reads: the DAG's nodes and the date that splits the samples
+CAUSAL_COLUMNS = list(dict.fromkeys(node for edge in CAUSAL_EDGES for node in edge)) + ['Date']
+
+# In-memory budget for fitted models, and optional directory to persist them in
+CAUSAL_CACHE_MAX_BYTES = int(os.environ.get("CAUSAL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CAUSAL_CACHE_DIR = os.environ.get("CAUSAL_CACHE_DIR")
+
+# Adaptive attribution: samples per chunk, sample budget (the previous fixed
+# sample count), chunks in the first round, and how many top factors must be
+# ranked before stopping early
+ATTRIBUTION_CHUNK_SAMPLES = int(os.environ.get("ATTRIBUTION_CHUNK_SAMPLES", 250))
+ATTRIBUTION_MAX_SAMPLES = int(os.environ.get("ATTRIBUTION_MAX_SAMPLES", 2000))
+ATTRIBUTION_MIN_CHUNKS = int(os.environ.get("ATTRIBUTION_MIN_CHUNKS", 4))
+ATTRIBUTION_TOP_K = int(os.environ.get("ATTRIBUTION_TOP_K", 3))
+# Chunks the top-k order must stay unchanged for when it is not yet resolved
+ATTRIBUTION_STABLE_CHUNKS = int(os.environ.get("ATTRIBUTION_STABLE_CHUNKS", 2))
+# z-value of the reported confidence intervals (95%)
+ATTRIBUTION_CI_Z = 1.96
+# Processes (joblib n_jobs) evaluating one attribution's Shapley coalitions,
+# capped at each causal worker's share of the CPUs so the pool does not
+# oversubscribe the machine
+_CPU_SHARE = max(1, (os.cpu_count() or 1) // max(1, CAUSAL_WORKERS))
+ATTRIBUTION_PARALLELISM = max(1, min(int(os.environ.get("ATTRIBUTION_PARALLELISM", _CPU_SHARE)), _CPU_SHARE))
+# Mechanism change test settings, as in gcm.distribution_change
+MECHANISM_CHANGE_SIGNIFICANCE = 0.05
+MECHANISM_CHANGE_FDR_METHOD = "fdr_bh"
+
+
+def build_dag(edges=CAUSAL_EDGES):
+    """Create the causal DAG using networkx"""
+    G = nx.DiGraph()
+    G.add_edges_from(edges)
+    return G
+
+
+def dag_key(edges=CAUSAL_EDGES):
+    """Stable hash of a DAG definition, used to invalidate cached models"""
+    return hashlib.sha256(repr(sorted(edges)).encode()).hexdigest()[:16]
+
+
+def prepare_causal_data(data):
+    """Drop unused columns and incomplete rows, and encode the categorical columns"""
+    data = data.drop(columns=DROPPED_COLUMNS, errors='ignore').dropna()
+    for col in CATEGORICAL_COLUMNS:
+        if col in data.columns:
+            data[col] = pd.Categorical(data[col]).codes
+    return data
+
+
+def fit_causal_model(data, edges=CAUSAL_EDGES):
+    """Assign causal mechanisms and fit an InvertibleStructuralCausalModel"""
+    causal_model = gcm.InvertibleStructuralCausalModel(build_dag(edges))
+    gcm.auto.assign_causal_mechanisms(causal_model, data)
+    gcm.fit(causal_model, data)
+    return causal_model
+
+
+class CausalModelCache:
+    """
+    LRU cache of fitted causal models keyed by (merchant, dataset fingerprint, DAG hash).
+
+    Entries are sized by their pickled length and the least recently used ones
+    are evicted once `max_bytes` is exceeded. When `cache_dir` is set, fitted
+    models are also pickled to disk and picked up again after a restart.
+    """
+    def __init__(self, max_bytes=CAUSAL_CACHE_MAX_BYTES, cache_dir=CAUSAL_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}  # key -> [lock, callers holding or waiting for it]
+
+    def get_or_fit(self, key, fit):
+        """Return the cached model for `key`, calling `fit()` on a miss"""
+        model = self._get(key)
+        if model is not None:
+            return model
+
+        # One fit per key at a time; concurrent requests for the same merchant wait for it.
+        # The key lock is refcounted, so it is only dropped once nobody holds or awaits it
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                model = self._get(key)
+                if model is None:
+                    model = self._load(key)
+                if model is None:
+                    model = fit()
+                    self._save(key, model)
+                self._put(key, model)
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key, model):
+        size = len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (model, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable causal model cache file {path}: {e}")
+            return None
+
+    def _save(self, key, model):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Worker processes sharing cache_dir can fit the same key at once:
+            # each writes its own temp file and the last rename wins
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=f"{os.path.basename(path)}.",
+                                             suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            # The model is fitted either way; it is just not persisted
+            logger.warning(f"Could not write causal model cache file {path}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+model_cache = CausalModelCache()
+
+
+def get_causal_model(handle, merchant, data, edges=CAUSAL_EDGES):
+    """Return the fitted model for a merchant's prepared data, fitting it at most once"""
+    key = (merchant, handle.fingerprint or handle.version, dag_key(edges))
+    return model_cache.get_or_fit(key, lambda: fit_causal_model(data, edges))
+
+
+@dataclass
+class AttributionResult:
+    """
+    Attribution scores with their confidence intervals.
+
+    `scores` maps each upstream factor to its absolute attribution and
+    `intervals` to the (low, high) bounds of the absolute value at
+    ATTRIBUTION_CI_Z. `num_samples` is the total number of samples drawn per
+    Shapley evaluation across all chunks.
+    """
+    kpi: str
+    scores: dict
+    intervals: dict = field(default_factory=dict)
+    num_samples: int = 0
+    chunks: int = 1
+    converged: bool = True
+
+    def as_dict(self):
+        return {
+            "kpi": self.kpi,
+            "scores": self.scores,
+            "intervals": {k: list(v) for k, v in self.intervals.items()},
+            "num_samples": self.num_samples,
+            "chunks": self.chunks,
+            "converged": self.converged,
+        }
+
+
+def mean_difference(x1, x2):
+    return np.mean(x2) - np.mean(x1)
+
+
+def _abs_interval(low, high):
+    """Bounds of |x| for x in [low, high]"""
+    if low >= 0:
+        return low, high
+    if high <= 0:
+        return -high, -low
+    return 0.0, max(-low, high)
+
+
+def summarize_chunks(chunks, z=ATTRIBUTION_CI_Z):
+    """
+    Combine per-chunk signed attributions into absolute scores and intervals.
+
+    Each chunk is an independent estimate from the same number of samples, so
+    their mean is the pooled estimate and its standard error shrinks with the
+    number of chunks. A single chunk has no intervals.
+    """
+    factors = list(chunks[0])
+    values = np.array([[chunk[k] for k in factors] for chunk in chunks], dtype=float)
+    mean = values.mean(axis=0)
+    scores = {k: abs(float(m)) for k, m in zip(factors, mean)}
+    if len(chunks) < 2:
+        # No spread to estimate an interval from
+        return scores, {}
+    half_width = z * values.std(axis=0, ddof=1) / np.sqrt(len(chunks))
+    intervals = {k: tuple(float(b) for b in _abs_interval(m - h, m + h)) for k, m, h in zip(factors, mean, half_width)}
+    return scores, intervals
+
+
+def top_factors(scores, k=ATTRIBUTION_TOP_K):
+    return tuple(sorted(scores, key=scores.get, reverse=True)[:k])
+
+
+def ranking_resolved(chunks, k=ATTRIBUTION_TOP_K, z=ATTRIBUTION_CI_Z):
+    """
+    True when the top `k` factors of the per-chunk signed attributions are
+    each separated from the factor ranked right below them.
+
+    Each factor's chunks are oriented by the sign of its mean, and a pair is
+    separated when the mean of their paired per-chunk differences clears `z`
+    standard errors. A factor whose attribution is zero in every chunk (its
+    mechanism did not change) can never outrank another one, so it needs no
+    test.
+    """
+    if len(chunks) < 2:
+        return False
+    scores, _ = summarize_chunks(chunks)
+    order = top_factors(scores, k + 1)
+    values = {factor: np.array([chunk[factor] for chunk in chunks]) for factor in order}
+    for a, b in zip(order, order[1:]):
+        if not values[b].any():
+            continue
+        diff = np.sign(values[a].mean()) * values[a] - np.sign(values[b].mean()) * values[b]
+        if diff.mean() <= z * diff.std(ddof=1) / np.sqrt(len(chunks)):
+            return False
+    return True
+
+
+def covering_kpi(graph, kpis):
+    """A KPI whose ancestors include every other requested KPI, or None"""
+    for kpi in kpis:
+        upstream = nx.ancestors(graph, kpi) | {kpi}
+        if all(other in upstream for other in kpis):
+            return kpi
+    return None
+
+
+def kpi_factors(graph, kpi):
+    """Upstream factors of a KPI, excluding the KPI nodes themselves"""
+    return sorted(nx.ancestors(graph, kpi) - set(CAUSAL_KPIS))
+
+
+def changed_mechanisms(graph, old_data, new_data):
+    """
+    {node: whether its mechanism changed significantly between the periods},
+    from gcm's mechanism change test with the p-values FDR-corrected, as
+    gcm.distribution_change decides it.
+    """
+    p_values = []
+    for node in graph.nodes:
+        parents = None if is_root_node(graph, node) else get_ordered_predecessors(graph, node)
+        p_values.append(mechanism_change_test(
+            old_data[node].to_numpy(), new_data[node].to_numpy(),
+            None if parents is None else old_data[parents].to_numpy(),
+            None if parents is None else new_data[parents].to_numpy(),
+        ))
+    changed = multipletests(p_values, MECHANISM_CHANGE_SIGNIFICANCE, method=MECHANISM_CHANGE_FDR_METHOD)[0]
+    return dict(zip(graph.nodes, changed))
+
+
+def fit_changed_mechanisms(causal_model, old_data, new_data, target):
+    """
+    Old and new copies of `target`'s subgraph, fitted the way
+    gcm.distribution_change fits them (mechanisms without a significant change
+    are fitted on both periods), but without its Shapley pass.
+    """
+    graph = nx.DiGraph(node_connected_subgraph_view(causal_model.graph, target))
+    old_model = gcm.ProbabilisticCausalModel(graph)
+    clone_causal_models(causal_model.graph, old_model.graph)
+    new_model = gcm.ProbabilisticCausalModel(nx.DiGraph(graph))
+    clone_causal_models(graph, new_model.graph)
+    nodes = list(graph.nodes)
+    old_data, new_data = old_data[nodes], new_data[nodes]
+    joint_data = pd.concat([old_data, new_data], ignore_index=True, sort=True)
+    for node, changed in changed_mechanisms(graph, old_data, new_data).items():
+        fit_causal_model_of_target(old_model, node, old_data if changed else joint_data)
+        fit_causal_model_of_target(new_model, node, new_data if changed else joint_data)
+    return old_model, new_model
+
+
+def joint_distribution_change(old_model, new_model, kpis, num_samples, chunks=1, n_jobs=ATTRIBUTION_PARALLELISM):
+    """
+    One Shapley pass attributing the change of every KPI in `kpis` at once,
+    as `chunks` independent estimates of `num_samples` samples each.
+
+    Each coalition of changed mechanisms is sampled once, `num_samples *
+    chunks` draws split into consecutive blocks, and every block is scored
+    against all KPIs: several KPIs and several chunks cost one model build
+    per coalition. Every coalition is sampled from the same seed (common
+    random numbers), so a mechanism that did not change contributes exactly
+    zero and the differences between coalitions carry no sampling noise of
+    their own. Coalitions are evaluated in `n_jobs` processes. Returns one
+    {kpi: {factor: signed attribution}} per chunk, restricted to each KPI's
+    upstream factors.
+    """
+    nodes = sorted(old_model.graph.nodes)
+    old_mechanisms = [old_model.causal_mechanism(node) for node in nodes]
+    new_mechanisms = [new_model.causal_mechanism(node) for node in nodes]
+
+    # gcm samples from numpy's global generator: reseed it for each coalition
+    # and restore it afterwards, so the Shapley estimator's own random
+    # permutations (and later calls) are left alone
+    seed = np.random.randint(2 ** 31)
+
+    def chunk_means(model):
+        state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            draws = gcm.draw_samples(model, num_samples * chunks)[kpis].to_numpy()
+        finally:
+            np.random.set_state(state)
+        return draws.reshape(chunks, num_samples, len(kpis)).mean(axis=1)
+
+    baseline = chunk_means(old_model)
+
+    def set_function(subset):
+        if np.all(subset == 0):
+            return np.zeros(chunks * len(kpis))
+        model = gcm.ProbabilisticCausalModel(nx.DiGraph(old_model.graph))
+        for node, changed, old, new in zip(nodes, subset, old_mechanisms, new_mechanisms):
+            model.set_causal_mechanism(node, new if changed == 1 else old)
+        for node in model.graph.nodes:
+            model.graph.nodes[node][PARENTS_DURING_FIT] = get_ordered_predecessors(model.graph, node)
+        return (chunk_means(model) - baseline).ravel()
+
+    shapley_values = np.atleast_2d(estimate_shapley_values(set_function, len(nodes), ShapleyConfig(n_jobs=n_jobs)))
+    shapley_values = shapley_values.reshape(chunks, len(kpis), len(nodes))
+    position = {node: i for i, node in enumerate(nodes)}
+    return [
+        {kpi: {factor: float(values[k][position[factor]]) for factor in kpi_factors(old_model.graph, kpi)}
+         for k, kpi in enumerate(kpis)}
+        for values in shapley_values
+    ]
+
+
+def attribute_distribution_change(handle, merchant, kpis, anomaly_date='2025-05-10', num_samples=None):
+    """
+    Attribute the change in each of `kpis` (a KPI name or a list of them)
+    between `anomaly_date` and the other days to the upstream factors of the
+    DAG. Returns one AttributionResult per KPI, in order.
+
+    All KPIs share one fitted model and one sampling pass. With `num_samples`
+    set, a single pass of that many samples is drawn. Otherwise the sample
+    count is adaptive: the old/new mechanisms are fitted once, then Shapley
+    estimates are drawn in chunks of ATTRIBUTION_CHUNK_SAMPLES, in rounds that
+    each double the number of chunks (starting with ATTRIBUTION_MIN_CHUNKS).
+    After each round the top ATTRIBUTION_TOP_K order is compared chunk by
+    chunk, and sampling stops as soon as the top factors of every KPI are
+    resolved (see ranking_resolved), or their order has not changed over the
+    last ATTRIBUTION_STABLE_CHUNKS chunks, and in any case at
+    ATTRIBUTION_MAX_SAMPLES.
+    """
+    kpis = [kpis] if isinstance(kpis, str) else list(dict.fromkeys(kpis))
+    with timed("data_load"):
+        data = handle.merchant(merchant, columns=CAUSAL_COLUMNS)
+    with timed("encoding"):
+        data = prepare_causal_data(data)
+    with timed("fit"):
+        causal_model = get_causal_model(handle, merchant, data)
+
+    sample1 = data[data['Date'] != anomaly_date].drop(columns='Date')
+    sample2 = data[data['Date'] == anomaly_date].drop(columns='Date')
+
+    target = covering_kpi(causal_model.graph, kpis)
+    if target is None:
+        # No single KPI's subgraph holds the others; attribute them one by one
+        return [result for kpi in kpis
+                for result in attribute_distribution_change(handle, merchant, kpi, anomaly_date, num_samples)]
+
+    with timed("distribution_change"):
+        return adaptive_distribution_change(causal_model, sample1, sample2, kpis, target, num_samples=num_samples)
+
+
+def adaptive_distribution_change(causal_model, old_data, new_data, kpis, target,
+                                 num_samples=None,
+                                 chunk_samples=ATTRIBUTION_CHUNK_SAMPLES,
+                                 parallelism=ATTRIBUTION_PARALLELISM,
+                                 max_samples=ATTRIBUTION_MAX_SAMPLES,
+                                 min_chunks=ATTRIBUTION_MIN_CHUNKS,
+                                 top_k=ATTRIBUTION_TOP_K,
+                                 stable_chunks=ATTRIBUTION_STABLE_CHUNKS):
+    """Chunked, early-stopping attribution of `kpis` (see attribute_distribution_change)"""
+    # `target`'s subgraph holds every KPI; its mechanisms are fitted once and
+    # every round only re-samples them
+    old_model, new_model = fit_changed_mechanisms(causal_model, old_data, new_data, target)
+    if num_samples is not None:
+        chunk_samples = max_samples = num_samples
+    chunks = []
+
+    max_chunks = max(1, max_samples // chunk_samples)
+    rankings, unchanged = None, 0
+    converged = num_samples is not None
+    while len(chunks) < max_chunks:
+        # Geometric rounds: the first draws `min_chunks`, each later one as
+        # many chunks as are already in, all in a single Shapley pass
+        batch = min(max(1, min_chunks, len(chunks)), max_chunks - len(chunks))
+        drawn = len(chunks)
+        chunks.extend(joint_distribution_change(old_model, new_model, kpis, chunk_samples, batch, parallelism))
+        # The round's chunks are drawn together, but the ranking is followed
+        # as if they had come in one at a time
+        for n in range(drawn + 1, len(chunks) + 1):
+            previous, rankings = rankings, [top_factors(summarize_chunks([chunk[kpi] for chunk in chunks[:n]])[0], top_k)
+                                            for kpi in kpis]
+            unchanged = unchanged + 1 if rankings == previous else 0
+        resolved = all(ranking_resolved([chunk[kpi] for chunk in chunks], top_k) for kpi in kpis)
+        if resolved or unchanged >= stable_chunks:
+            converged = True
+            break
+
+    logger.info(f"Attributed {', '.join(kpis)} with {len(chunks)} chunks of {chunk_samples} samples (converged={converged})")
+    results = []
+    for kpi in kpis:
+        scores, intervals = summarize_chunks([chunk[kpi] for chunk in chunks])
+        results.append(AttributionResult(kpi=kpi, scores=scores, intervals=intervals,
+                                         num_samples=len(chunks) * chunk_samples, chunks=len(chunks),
+                                         converged=converged))
+    return results
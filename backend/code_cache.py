@@ -0,0 +1,219 @@
+import ast
+import io
+import re
+import tokenize
+from datetime import date
+
+from .banks import BANK_TOKENS
+from .dataset import get_dataset
+from .llm_cache import ResponseCache
+from .metrics import register_cache
+from .periods import today
+
+MONTHS = {
+    "jan": 1, "january": 1, "feb": 2, "february": 2, "mar": 3, "march": 3, "apr": 4, "april": 4,
+    "may": 5, "jun": 6, "june": 6, "jul": 7, "july": 7, "aug": 8, "august": 8,
+    "sep": 9, "sept": 9, "september": 9, "oct": 10, "october": 10, "nov": 11, "november": 11,
+    "dec": 12, "december": 12,
+}
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+DATE_PATTERNS = [
+    re.compile(r"\b(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})\b"),
+    re.compile(rf"\b(?P<mon>{_MONTH})\.? (?P<d>\d{{1,2}})(?P<ord>st|nd|rd|th)?(?:,? (?P<y>\d{{4}}))?\b"),
+    re.compile(rf"\b(?P<d>\d{{1,2}})(?P<ord>st|nd|rd|th)? (?P<of>of )?(?P<mon>{_MONTH})\b\.?(?:,? (?P<y>\d{{4}}))?"),
+]
+# A month/day date without an ordinal, "of" or a year ("top 5 march", "may 5")
+# only counts when one of these words comes right before it ("on 5 march")
+DATE_CONTEXT = re.compile(r"\b(?:on|for|from|to|since|until|till|between|and|before|after|of)\s+$")
+# String literals in generated code that look like a date
+DATE_LITERAL = re.compile(r"\d{4}-\d{1,2}-\d{1,2}")
+
+PLACEHOLDER = "__PARAM_{}__"
+
+
+# Generated snippets with placeholders, keyed by the system message and the templated question
+code_template_cache = register_cache("code", ResponseCache("code"))
+
+_entities = (None, [], None, {})
+
+
+def _load_entities():
+    """
+    The entities of the current dataset, with one regex matching any of their
+    surfaces and a {lowercased surface: [(kind, literal)]} map, rebuilt once
+    per dataset version
+    """
+    global _entities
+    handle = get_dataset()
+    if _entities[0] == handle.version:
+        return _entities
+
+    entities = []
+    if handle.has_column('Payment Mode Name'):
+        for mode in handle.unique('Payment Mode Name'):
+            entities.append(("payment_mode", str(mode), str(mode)))
+    for token, bank in BANK_TOKENS.items():
+        entities.append(("bank", token, bank))
+    for merchant in handle.merchants():
+        entities.append(("merchant", str(merchant), str(merchant)))
+    # Longest surface first, so "NET BANKING" wins over a shorter overlapping name
+    entities.sort(key=lambda e: len(e[1]), reverse=True)
+    by_surface = {}
+    for kind, surface, literal in entities:
+        by_surface.setdefault(surface.lower(), []).append((kind, literal))
+    # One alternation instead of a pattern per entity: thousands of merchants
+    # would otherwise overflow re's pattern cache and recompile on every question
+    pattern = re.compile(rf"(?<!\w)(?:{'|'.join(re.escape(surface) for surface in by_surface)})(?!\w)",
+                         re.IGNORECASE) if by_surface else None
+    _entities = (handle.version, entities, pattern, by_surface)
+    return _entities
+
+
+def _dataset_entities():
+    """(kind, surface text, code literal) for payment modes, banks and merchants"""
+    return _load_entities()[1]
+
+
+def _date_in_context(question, match):
+    """Whether a date match is unambiguous: ISO, ordinal, "of", a year, or a date word before it"""
+    parts = match.groupdict()
+    if parts.get("m") or parts.get("ord") or parts.get("of") or parts.get("y"):
+        return True
+    return DATE_CONTEXT.search(question[:match.start()]) is not None
+
+
+def _bank_in_context(question, match):
+    """Bank tokens are also words ("yes", "axis"): require capitals or a following "bank" """
+    return match.group().isupper() or re.match(r"\s+bank\b", question[match.end():], re.IGNORECASE) is not None
+
+
+def reserved_literals():
+    """Code literals of every known entity, which a cached template must not hard-code"""
+    return {literal for _, _, literal in _dataset_entities()} | set(BANK_TOKENS)
+
+
+def extract_parameters(question):
+    """
+    Replace dates, payment modes, banks and merchants in the question with
+    numbered placeholders.
+
+    Returns (template_question, values) where `values[i]` is the literal the
+    generated code would use for placeholder i (ISO date, dataset value or
+    bank token).
+    """
+    # Dates like "May 5th" are in the year of today() (the "today" of get_system_message)
+    default_year = today().year
+    lowered = question.lower()
+    spans = []
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(lowered):
+            parts = match.groupdict()
+            if not _date_in_context(lowered, match):
+                continue
+            month = int(parts["m"]) if parts.get("m") else MONTHS[parts["mon"]]
+            try:
+                value = date(int(parts["y"] or default_year), month, int(parts["d"])).isoformat()
+            except ValueError:
+                continue
+            spans.append((match.start(), match.end(), "date", value))
+    _, _, pattern, by_surface = _load_entities()
+    for match in pattern.finditer(question) if pattern else ():
+        for kind, literal in by_surface[match.group().lower()]:
+            if kind != "bank" or _bank_in_context(question, match):
+                spans.append((match.start(), match.end(), kind, literal))
+                break
+
+    # Keep the earliest, then longest, non-overlapping spans
+    spans.sort(key=lambda s: (s[0], -(s[1] - s[0])))
+    chosen, end = [], -1
+    for span in spans:
+        if span[0] >= end:
+            chosen.append(span)
+            end = span[1]
+
+    template, values, last = [], [], 0
+    for i, (start, stop, kind, literal) in enumerate(chosen):
+        template.append(question[last:start])
+        template.append(f"<{kind}_{i}>")
+        values.append(literal)
+        last = stop
+    template.append(question[last:])
+    return "".join(template), values
+
+
+def _string_literal(token):
+    try:
+        value = ast.literal_eval(token.string)
+    except (ValueError, SyntaxError):
+        return None
+    return value if isinstance(value, str) else None
+
+
+def parameterize_code(code, values, reserved=()):
+    """
+    Replace whole string literals equal to `values[i]` with placeholder i.
+
+    Returns None when the snippet cannot be parameterized safely: a value is
+    missing from the code, two parameters share the same literal, or a
+    literal that is not a parameter looks like a date or is one of the
+    `reserved` entity literals. Such literals are usually derived from a
+    parameter (the day after, the end of the week) and would stay behind
+    when the template is re-bound.
+    """
+    if len(set(values)) != len(values):
+        return None
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+
+    positions = {value: i for i, value in enumerate(values)}
+    edits = []
+    for token in tokens:
+        if token.type == tokenize.STRING:
+            value = _string_literal(token)
+            i = positions.get(value)
+            if i is not None:
+                edits.append((token.start, token.end, repr(PLACEHOLDER.format(i)), i))
+            elif DATE_LITERAL.search(token.string) or value in reserved:
+                return None
+    if {edit[3] for edit in edits} != set(range(len(values))):
+        return None
+
+    # Apply edits right-to-left so earlier (row, col) offsets stay valid
+    lines = code.splitlines(keepends=True)
+    for (start_row, start_col), (end_row, end_col), text, _ in reversed(edits):
+        if start_row != end_row:
+            return None
+        line = lines[start_row - 1]
+        lines[start_row - 1] = line[:start_col] + text + line[end_col:]
+    return "".join(lines)
+
+
+def bind_code(template_code, values):
+    """Substitute the question's parameter values back into a cached snippet"""
+    code = template_code
+    for i, value in enumerate(values):
+        code = code.replace(repr(PLACEHOLDER.format(i)), repr(value))
+    return code
+
+
+def lookup(question, system_message):
+    """Return a ready-to-run snippet for the question, or None on a miss"""
+    template_question, values = extract_parameters(question)
+    template_code = code_template_cache.get(system_message, template_question)
+    if template_code is None:
+        return None
+    return bind_code(template_code, values)
+
+
+def store(question, system_message, code):
+    """Cache a snippet that executed successfully; returns False if it cannot be templated"""
+    if "Unable to generate python snippet" in code:
+        return False
+    template_question, values = extract_parameters(question)
+    template_code = parameterize_code(code, values, reserved_literals())
+    if template_code is None:
+        return False
+    code_template_cache.set(system_message, template_question, template_code)
+    return True
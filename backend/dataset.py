@@ -0,0 +1,463 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from .banks import ACQUIRER_COLUMN, BANK_COLUMN, add_bank_column
+from . import schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = os.environ.get("DATA_PATH", "data/data_cleaned.csv")
+# Set DATASET_CACHE=0 to always parse the CSV directly
+USE_COLUMNAR_CACHE = os.environ.get("DATASET_CACHE", "1") != "0"
+# Set DATASET_IN_MEMORY=0 for exports too large to hold in RAM: the store then
+# keeps no frame and every slice is streamed from disk (see read_slice)
+DATASET_IN_MEMORY = os.environ.get("DATASET_IN_MEMORY", "1") != "0"
+# Rows parsed per chunk when streaming the CSV
+DATASET_CHUNK_ROWS = int(os.environ.get("DATASET_CHUNK_ROWS", 500_000))
+
+
+@dataclass(frozen=True)
+class DatasetHandle:
+    """
+    Immutable, versioned view of the transaction dataset.
+
+    The frame is shared by every request in the process, so callers must treat
+    it as read-only and filter/copy before mutating. `merchant_index` maps each
+    merchant to the positions of its rows, so a merchant slice costs a dict
+    lookup plus a gather of that merchant's rows rather than a scan of the
+    whole `Merchant Display Name` column.
+
+    The frame is sorted by `Date` and `dates` holds that column as a sorted
+    datetime64 array, so date windows are found by binary search: a
+    merchant's positions are in date order too, and its window is a
+    contiguous run of them.
+
+    Out-of-core handles (DATASET_IN_MEMORY=0) have no frame: slices are
+    streamed from `path` on every call, so replace the file only together with
+    a reload.
+    """
+    version: int
+    path: str
+    frame: pd.DataFrame
+    loaded_at: float
+    merchant_index: dict = field(default_factory=dict, repr=False)
+    # Identifies the file contents across processes/restarts (size + mtime)
+    fingerprint: str = ""
+    rows: int = 0
+    # Merchant names of an out-of-core handle, which has no merchant_index
+    merchant_names: tuple = field(default=(), repr=False)
+    # Sorted `Date` values of the frame (None without a frame or a Date column)
+    dates: np.ndarray = field(default=None, repr=False)
+    last_date: date = None
+
+    def merchant(self, merchant, columns=None, start=None, end=None):
+        """
+        Return the rows for a single merchant (a new frame, safe to mutate),
+        optionally only `columns` and the days from `start` to `end` (inclusive)
+        """
+        if self.frame is None:
+            return read_slice(self.path, [merchant], start, end, columns)
+        positions = self.merchant_index.get(merchant, _NO_ROWS)
+        if self.dates is not None and (start is not None or end is not None):
+            positions = positions[date_bounds(self.dates[positions], start, end)]
+            rows = self.frame.take(positions)
+        else:
+            rows = filter_rows(self.frame.take(positions), start=start, end=end)
+        return rows[list(columns)] if columns is not None else rows
+
+    def between(self, start=None, end=None, columns=None):
+        """
+        Rows of every merchant from `start` to `end` (inclusive). In memory
+        this is a slice of the shared frame: read-only, copy before mutating.
+        """
+        if self.frame is None:
+            return read_slice(self.path, None, start, end, columns)
+        rows = self.frame.iloc[date_bounds(self.dates, start, end)]
+        return rows[list(columns)] if columns is not None else rows
+
+    def merchants(self):
+        """Return the merchant names present in the dataset"""
+        if self.frame is None:
+            return list(self.merchant_names)
+        return list(self.merchant_index)
+
+    def unique(self, column):
+        """Distinct non-null values of a column"""
+        if self.frame is None:
+            values = {}
+            for chunk in iter_csv_chunks(self.path, [column]):
+                values.update(dict.fromkeys(chunk[column].dropna().unique()))
+            return list(values)
+        return list(self.frame[column].dropna().unique())
+
+    def has_column(self, column):
+        if column == BANK_COLUMN:
+            # Derived on load, whenever the raw acquirer column is there
+            column = ACQUIRER_COLUMN
+        return column in (self.frame.columns if self.frame is not None else _csv_columns(self.path))
+
+
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
+def build_merchant_index(frame):
+    """Group row positions by `Merchant Display Name` (one pass at load time)"""
+    if 'Merchant Display Name' not in frame.columns:
+        return {}
+    return frame.groupby('Merchant Display Name', sort=False, observed=True).indices
+
+
+def sort_by_date(frame):
+    """`frame` ordered by `Date` (stable, so rows of a day keep their file order)"""
+    if 'Date' not in frame.columns or frame['Date'].is_monotonic_increasing:
+        return frame
+    return frame.sort_values('Date', kind='stable', ignore_index=True)
+
+
+def date_bounds(dates, start=None, end=None):
+    """The slice of the sorted datetime64 array `dates` from `start` to `end` (inclusive)"""
+    low = 0 if start is None else np.searchsorted(dates, pd.Timestamp(start).to_datetime64(), side='left')
+    high = len(dates) if end is None else np.searchsorted(dates, pd.Timestamp(end).to_datetime64(), side='right')
+    return slice(int(low), int(high))
+
+
+def between_dates(frame, start=None, end=None):
+    """
+    Rows of `frame` with `Date` from `start` to `end` (inclusive). Frames
+    from the dataset store are sorted by `Date`, so this is a binary search
+    and a slice; other frames fall back to a boolean mask.
+    """
+    dates = frame['Date']
+    if not (pd.api.types.is_datetime64_dtype(dates) and dates.is_monotonic_increasing):
+        return filter_rows(frame, start=start, end=end)
+    return frame.iloc[date_bounds(dates.to_numpy(), start, end)]
+
+
+def file_fingerprint(path):
+    """Cheap content identity for a data file: its size and mtime"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def parse_csv(path):
+    """Parse the cleaned CSV into a DataFrame with the dtypes of backend/schema.py"""
+    return schema.read_csv(path)
+
+
+def _csv_columns(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def filter_rows(frame, merchants=None, start=None, end=None):
+    """Rows of `merchants` with `Date` from `start` to `end` (inclusive); None skips a filter"""
+    mask = np.ones(len(frame), dtype=bool)
+    if merchants is not None:
+        mask &= frame['Merchant Display Name'].isin(merchants).to_numpy()
+    if start is not None:
+        mask &= (frame['Date'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (frame['Date'] <= pd.Timestamp(end)).to_numpy()
+    return frame if mask.all() else frame[mask]
+
+
+def iter_csv_chunks(path, columns=None, chunk_rows=DATASET_CHUNK_ROWS):
+    """Stream the CSV `chunk_rows` rows at a time, parsing only `columns`, with the schema dtypes"""
+    return schema.read_csv(path, columns, chunk_rows)
+
+
+def _read_columns(columns, merchants, start, end):
+    """Columns to read from disk for a projection, including the filter and source columns"""
+    read = list(columns)
+    if BANK_COLUMN in read:
+        # Derived from the raw acquirer column, when the export has one
+        read.remove(BANK_COLUMN)
+        if ACQUIRER_COLUMN:
+            read.append(ACQUIRER_COLUMN)
+    if merchants is not None:
+        read.append('Merchant Display Name')
+    if start is not None or end is not None:
+        read.append('Date')
+    return list(dict.fromkeys(read))
+
+
+def _read_arrow_slice(arrow_path, merchants, start, end, columns):
+    """Filter the memory-mapped columnar cache before converting to pandas, so only the slice is materialized"""
+    table = feather.read_table(arrow_path, columns=columns, memory_map=True)
+    mask = None
+
+    def both(condition):
+        return condition if mask is None else pc.and_(mask, condition)
+
+    if merchants is not None:
+        mask = both(pc.is_in(table['Merchant Display Name'], value_set=pa.array(list(merchants))))
+    if start is not None:
+        mask = both(pc.greater_equal(table['Date'], pa.scalar(pd.Timestamp(start), type=table.schema.field('Date').type)))
+    if end is not None:
+        mask = both(pc.less_equal(table['Date'], pa.scalar(pd.Timestamp(end), type=table.schema.field('Date').type)))
+    if mask is not None:
+        table = table.filter(mask)
+    return table.to_pandas(split_blocks=True)
+
+
+def read_slice(path, merchants=None, start=None, end=None, columns=None, chunk_rows=DATASET_CHUNK_ROWS):
+    """
+    Load only the rows of `merchants` from `start` to `end` (inclusive) and
+    only `columns`, without ever holding the whole file in memory.
+
+    A fresh columnar cache is memory-mapped and filtered in Arrow; otherwise
+    the CSV is parsed in chunks of `chunk_rows` rows, reading only the needed
+    columns and filtering each chunk as it is read. The derived bank column
+    is added when the acquirer column is loaded. Rows are in `Date` order.
+    """
+    read = None if columns is None else _read_columns(columns, merchants, start, end)
+    arrow_path, meta_path = cache_paths(path)
+    if pa is not None and USE_COLUMNAR_CACHE and _cache_is_fresh(path, arrow_path, meta_path):
+        frame = _read_arrow_slice(arrow_path, merchants, start, end, read)
+    else:
+        parts = [filter_rows(chunk, merchants, start, end) for chunk in iter_csv_chunks(path, read, chunk_rows)]
+        frame = schema.concat(parts) if parts else pd.DataFrame(columns=read)
+    frame = sort_by_date(add_bank_column(frame))
+    return frame[list(columns)] if columns is not None else frame
+
+
+def cache_paths(csv_path):
+    """Return (arrow_path, meta_path) of the columnar cache for a CSV file"""
+    directory, name = os.path.split(os.path.abspath(csv_path))
+    stem = os.path.splitext(name)[0]
+    cache_dir = os.path.join(directory, ".cache")
+    return os.path.join(cache_dir, f"{stem}.arrow"), os.path.join(cache_dir, f"{stem}.meta.json")
+
+
+def _file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_is_fresh(csv_path, arrow_path, meta_path):
+    """
+    Check the cache against the CSV. A matching mtime/size is trusted as-is;
+    otherwise the CSV is hashed, so a touched-but-unchanged file does not
+    trigger a rebuild.
+    """
+    if not (os.path.exists(arrow_path) and os.path.exists(meta_path)):
+        return False
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get("schema") != schema.SCHEMA_VERSION:
+        return False
+    stat = os.stat(csv_path)
+    if meta.get("mtime_ns") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+        return True
+    if meta.get("sha256") != _file_sha256(csv_path):
+        return False
+    meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    _write_json(meta_path, meta)
+    return True
+
+
+@contextmanager
+def _replacing(path):
+    """
+    Yield a fresh temp path next to `path` and rename it over `path` once the
+    block succeeds. Each writer gets its own temp file, so concurrent builds
+    never write into the same one, and readers never see a partial file.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.",
+                                     suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_json(path, payload):
+    with _replacing(path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+
+
+def build_columnar_cache(csv_path):
+    """Parse the CSV and write it, sorted by `Date`, as an uncompressed Arrow IPC file next to it"""
+    arrow_path, meta_path = cache_paths(csv_path)
+    os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+    stat = os.stat(csv_path)
+    df = sort_by_date(parse_csv(csv_path))
+
+    with _replacing(arrow_path) as tmp_path:
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+    _write_json(meta_path, {
+        "csv": os.path.abspath(csv_path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": _file_sha256(csv_path),
+        "schema": schema.SCHEMA_VERSION,
+    })
+    logger.info(f"Built columnar cache {arrow_path} ({len(df)} rows)")
+    return df
+
+
+def read_dataset(path):
+    """
+    Load the cleaned dataset, going through the columnar cache when possible.
+
+    The first load converts the CSV into a typed Arrow file under
+    `<csv dir>/.cache/`; later loads memory-map that file instead of running
+    the CSV parser. The cache is rebuilt when the CSV's mtime/size and content
+    hash no longer match.
+    """
+    if pa is None or not USE_COLUMNAR_CACHE:
+        return parse_csv(path)
+    arrow_path, meta_path = cache_paths(path)
+    try:
+        if not _cache_is_fresh(path, arrow_path, meta_path):
+            return build_columnar_cache(path)
+        table = feather.read_table(arrow_path, memory_map=True)
+        return table.to_pandas(split_blocks=True)
+    except OSError as e:
+        logger.warning(f"Columnar cache unavailable ({e}); parsing CSV directly")
+        return parse_csv(path)
+
+
+class DatasetStore:
+    """
+    Process-wide holder of the current DatasetHandle.
+
+    The dataset is loaded lazily on first access (or eagerly via `load()` at
+    startup). `reload()` parses the file again and atomically swaps in a new
+    handle with a bumped version; requests already holding the previous handle
+    keep using it until they finish.
+    """
+    def __init__(self, path=DATA_PATH, in_memory=DATASET_IN_MEMORY):
+        self.path = path
+        self.in_memory = in_memory
+        self._handle = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current handle, loading the dataset on first use"""
+        handle = self._handle
+        if handle is None:
+            with self._lock:
+                if self._handle is None:
+                    self._handle = self._load()
+                handle = self._handle
+        return handle
+
+    def load(self):
+        """Eagerly load the dataset (no-op if it is already loaded)"""
+        return self.get()
+
+    def reload(self):
+        """Re-read the dataset from disk and publish it as a new version"""
+        with self._lock:
+            self._handle = self._load()
+            return self._handle
+
+    def _load(self):
+        fingerprint = file_fingerprint(self.path)
+        if not self.in_memory:
+            return self._load_out_of_core(fingerprint)
+        # Derived columns are recomputed per version rather than stored in the columnar cache.
+        # The columnar cache is already sorted, so only a direct CSV parse pays for the sort
+        frame = sort_by_date(add_bank_column(schema.validate(read_dataset(self.path), self.path)))
+        dates = frame['Date'].to_numpy() if 'Date' in frame.columns else None
+        self._version += 1
+        return DatasetHandle(
+            version=self._version,
+            path=self.path,
+            frame=frame,
+            loaded_at=time.time(),
+            merchant_index=build_merchant_index(frame),
+            fingerprint=fingerprint,
+            rows=len(frame),
+            dates=dates,
+            last_date=_last_date(dates),
+        )
+
+    def _load_out_of_core(self, fingerprint):
+        """Scan only the merchant and date columns, for the row count, merchant names and last date"""
+        head = next(iter_csv_chunks(self.path, chunk_rows=1000), None)
+        if head is not None:
+            schema.validate(head, self.path)
+        has_dates = head is not None and 'Date' in head.columns
+        rows, merchants, last_dates = 0, {}, []
+        for chunk in iter_csv_chunks(self.path, ['Merchant Display Name'] + (['Date'] if has_dates else [])):
+            rows += len(chunk)
+            merchants.update(dict.fromkeys(chunk['Merchant Display Name'].dropna().unique()))
+            if has_dates:
+                last_dates.append(chunk['Date'].max())
+        last = max((d for d in last_dates if pd.notna(d)), default=None)
+        self._version += 1
+        return DatasetHandle(
+            version=self._version,
+            path=self.path,
+            frame=None,
+            loaded_at=time.time(),
+            fingerprint=fingerprint,
+            rows=rows,
+            merchant_names=tuple(merchants),
+            last_date=last.date() if last is not None else None,
+        )
+
+
+def _last_date(dates):
+    """Last non-missing date of a sorted datetime64 array (NaT sorts last)"""
+    if dates is None:
+        return None
+    present = dates[~np.isnat(dates)]
+    return pd.Timestamp(present[-1]).date() if len(present) else None
+
+
+_store = DatasetStore()
+
+
+def get_dataset():
+    """Return the current process-wide DatasetHandle"""
+    return _store.get()
+
+
+def reload_dataset():
+    """
+    Reload hook: re-read the dataset from disk and return the new handle.
+
+    Call this after `data/data_cleaned.csv` has been replaced (it is exposed on
+    the API as `POST /admin/reload-dataset`).
+    """
+    return _store.reload()
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from .llm import count_tokens
+
+load_dotenv()
+
+# Token budget of the summary handed to the /business-insights prompt
+EDA_TOKEN_BUDGET = int(os.environ.get("EDA_TOKEN_BUDGET", 1200))
+# Days before the analysed date that form the comparison baseline
+EDA_BASELINE_DAYS = int(os.environ.get("EDA_BASELINE_DAYS", 7))
+EDA_TOP_CATEGORIES = int(os.environ.get("EDA_TOP_CATEGORIES", 5))
+
+# Identifier columns that carry no signal for the analysis
+EDA_SKIPPED_COLUMNS = ['Merchant Display Name', 'Date']
+
+# Progressively smaller renderings tried until the summary fits the budget:
+# (top categories per column, include percentiles and extremes)
+DETAIL_LEVELS = [(EDA_TOP_CATEGORIES, True), (3, True), (3, False), (2, False), (1, False)]
+
+
+def split_window(frame, date, baseline_days=EDA_BASELINE_DAYS):
+    """Rows on `date` and rows in the `baseline_days` days before it"""
+    day = pd.Timestamp(date)
+    dates = frame['Date']
+    window = frame[dates == day]
+    baseline = frame[(dates < day) & (dates >= day - pd.Timedelta(days=baseline_days))]
+    return window, baseline
+
+
+def numeric_stats(window, baseline, columns):
+    """One row per numeric column: distribution on the day and change in mean against the baseline"""
+    if not columns:
+        return pd.DataFrame()
+    values = window[columns]
+    stats = values.agg(['count', 'mean', 'min', 'max', 'sum']).T
+    quantiles = values.quantile([0.5, 0.9]).T
+    stats['p50'], stats['p90'] = quantiles[0.5], quantiles[0.9]
+    stats['null_rate'] = values.isna().mean()
+    stats['baseline_mean'] = baseline[columns].mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['delta_pct'] = (stats['mean'] - stats['baseline_mean']) / stats['baseline_mean'].abs() * 100
+    stats.loc[~np.isfinite(stats['delta_pct']), 'delta_pct'] = np.nan
+    return stats
+
+
+def category_stats(window, baseline, column, top):
+    """Top values of a categorical column with their share on the day and in the baseline"""
+    share = window[column].value_counts(normalize=True, dropna=True)
+    baseline_share = baseline[column].value_counts(normalize=True, dropna=True)
+    # Categorical dtypes also count categories that do not occur
+    share, baseline_share = share[share > 0], baseline_share[baseline_share > 0]
+    top_values = share.head(top)
+    return {
+        "distinct": int(window[column].nunique()),
+        "null_rate": float(window[column].isna().mean()) if len(window) else 0.0,
+        "top": [(value, float(s), float(baseline_share.get(value, 0.0))) for value, s in top_values.items()],
+        # Largest absolute shift in share across all values, used to rank columns
+        "shift": float(share.sub(baseline_share, fill_value=0.0).abs().max()) if len(share) else 0.0,
+    }
+
+
+def summarize(frame, date, baseline_days=EDA_BASELINE_DAYS, top=EDA_TOP_CATEGORIES):
+    """
+    Compact EDA of `frame` on `date`: per-column distributions, top
+    categories, null rates and deltas against the preceding baseline window.
+    """
+    window, baseline = split_window(frame, date, baseline_days)
+    columns = [c for c in frame.columns if c not in EDA_SKIPPED_COLUMNS]
+    numeric = [c for c in columns if pd.api.types.is_numeric_dtype(frame[c]) and not pd.api.types.is_bool_dtype(frame[c])]
+    categorical = [c for c in columns if c not in numeric]
+    baseline_dates = baseline['Date'].nunique() if len(baseline) else 0
+    return {
+        "date": pd.Timestamp(date).date().isoformat(),
+        "rows": len(window),
+        "baseline_rows": len(baseline),
+        "baseline_days": baseline_days,
+        "baseline_rows_per_day": len(baseline) / baseline_dates if baseline_dates else 0.0,
+        "numeric": numeric_stats(window, baseline, numeric),
+        "categorical": {c: category_stats(window, baseline, c, top) for c in categorical},
+    }
+
+
+def _num(value):
+    if value is None or pd.isna(value):
+        return "n/a"
+    if abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.4g}"
+
+
+def render(summary, top=EDA_TOP_CATEGORIES, detailed=True, columns=None):
+    """Render a summary as prompt text; `columns` restricts it to those columns"""
+    lines = [
+        f"Transactions on {summary['date']}: {summary['rows']:,} "
+        f"(baseline: {summary['baseline_rows_per_day']:,.1f}/day over the previous {summary['baseline_days']} days)"
+    ]
+    if not summary["rows"]:
+        return lines[0]
+    numeric = summary["numeric"]
+    if columns is not None and len(numeric):
+        numeric = numeric[numeric.index.isin(columns)]
+    if len(numeric):
+        lines.append("Numeric columns (on the day; change in mean vs baseline):")
+        for column, row in numeric.iterrows():
+            parts = [f"mean {_num(row['mean'])}"]
+            if pd.notna(row['delta_pct']):
+                parts.append(f"{row['delta_pct']:+.1f}% vs baseline {_num(row['baseline_mean'])}")
+            if detailed:
+                parts += [f"median {_num(row['p50'])}", f"p90 {_num(row['p90'])}",
+                          f"min {_num(row['min'])}", f"max {_num(row['max'])}"]
+            parts.append(f"total {_num(row['sum'])}")
+            if row['null_rate'] > 0:
+                parts.append(f"{row['null_rate']:.1%} null")
+            lines.append(f"- {column}: " + ", ".join(parts))
+    categorical = {c: s for c, s in summary["categorical"].items() if columns is None or c in columns}
+    if categorical:
+        lines.append("Categorical columns (share on the day, baseline share in brackets):")
+        for column, stats in categorical.items():
+            values = ", ".join(f"{value} {s:.0%} ({b:.0%})" for value, s, b in stats["top"][:top])
+            null = f"; {stats['null_rate']:.1%} null" if stats["null_rate"] > 0 else ""
+            lines.append(f"- {column} ({stats['distinct']} values): {values}{null}")
+    return "\n".join(lines)
+
+
+def _columns_by_change(summary):
+    """Columns ordered from the largest to the smallest change against the baseline"""
+    scores = {}
+    numeric = summary["numeric"]
+    if len(numeric):
+        scores.update(numeric['delta_pct'].abs().fillna(0.0).to_dict())
+    for column, stats in summary["categorical"].items():
+        # Express share shifts in percentage points so they rank alongside % deltas
+        scores[column] = stats["shift"] * 100
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def budgeted_summary(frame, date, budget=EDA_TOKEN_BUDGET, model="gpt-4o", baseline_days=EDA_BASELINE_DAYS):
+    """
+    Render the EDA summary of `frame` on `date` within `budget` tokens.
+
+    Detail is reduced first (fewer top categories, no percentiles); if it
+    still does not fit, the columns that changed least against the baseline
+    are dropped. Returns (text, tokens).
+    """
+    summary = summarize(frame, date, baseline_days)
+    for top, detailed in DETAIL_LEVELS:
+        text = render(summary, top, detailed)
+        tokens = count_tokens(text, model)
+        if tokens <= budget:
+            return text, tokens
+
+    columns = _columns_by_change(summary)
+    top, detailed = DETAIL_LEVELS[-1]
+    while len(columns) > 1:
+        columns = columns[:-1]
+        text = render(summary, top, detailed, set(columns))
+        tokens = count_tokens(text, model)
+        if tokens <= budget:
+            break
+    return text, tokens
@@ -1,52 +1,46 @@
 import ast
+import asyncio
+import json
 import re
 import os
+from functools import lru_cache
 import pandas as pd
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from .llm import achat, astream_chat, record_cache_hit
+from .dataset import DATA_PATH, between_dates, get_dataset, read_slice
+from .banks import BANK_COLUMN, BANK_TOKENS, map_acquirer, map_acquirer_series
+from . import code_cache
+from .sandbox import sandbox_pool
+from .result_cache import result_cache, result_key
+from .metrics import timed
+from .periods import time_periods, today
 
 load_dotenv()
 
 
-# Bank mapping utilities
-BANK_TOKENS = {
-    "AXIS": "AXIS", 
-    "HDFC": "HDFC", 
-    "KOTAK": "KOTAK",
-    "ICICI": "ICICI", 
-    "INDUSIND": "INDUSIND_BANK", 
-    "RBL": "RBL",
-    "SCB": "STANDARD_CHARTERED_BANK", 
-    "YES": "YES",
-    "PNB": "PNB", 
-    "IOB": "INDIAN_OVERSEAS_BANK"
-}
-
-
 def safe_divide(numer, denom):
     """Safe division function to avoid division by zero errors."""
     return numer / denom if denom else 0
 
 
-def map_acquirer(acq):
-    """Map acquirer names to standardized bank tokens."""
-    s = re.sub(r"[^A-Z]", "", str(acq).upper())
-    for k, v in BANK_TOKENS.items():
-        if k in s:
-            return v
-    return "OTHER"
-
+def load_data(file_path=DATA_PATH, merchant=None):
+    """
+    Load and prepare the cleaned data.
 
-def load_data(file_path="data/data_cleaned.csv",merchant=None):
-    """Load and prepare the cleaned data."""
+    The default dataset is served from the process-wide store, so it is only
+    parsed once; any other path is streamed from disk on every call, keeping
+    only the merchant's rows.
+    """
     try:
-        df = pd.read_csv(file_path)
-        # Convert Date column to datetime if it exists
-        if 'Date' in df.columns:
-            df['Date'] = pd.to_datetime(df['Date'])
-        if merchant:
-            df = df[df['Merchant Display Name'] == merchant]
-        return df
+        if file_path == DATA_PATH:
+            handle = get_dataset()
+            if merchant:
+                return handle.merchant(merchant)
+            if handle.frame is None:
+                return read_slice(handle.path)
+            # Shallow copy so generated code cannot add columns to the shared frame
+            return handle.frame.copy(deep=False)
+        return read_slice(file_path, [merchant] if merchant else None)
     except FileNotFoundError:
         print(f"Error: Could not find file {file_path}")
         return None
@@ -55,12 +49,28 @@ def load_data(file_path="data/data_cleaned.csv",merchant=None):
         return None
 
 
-def get_system_message():
-    """Return the system message for the LLM."""
-    return """You are an expert Python data-analyst and payments-domain SME.
+BANK_COLUMN_OVERVIEW = """
+- Acquirer Bank                    normalized bank token, pre-computed with map_acquirer
+                                   (categorical: "HDFC", "AXIS", …, "OTHER")"""
+
+BANK_COLUMN_USAGE = """For bank-level questions use the pre-computed df['Acquirer Bank'] column
+(e.g. df.groupby('Acquirer Bank', observed=True)), never df[...].apply(map_acquirer).
+If another column must be mapped"""
+
+
+def get_system_message(day=None):
+    """
+    Return the system message for the LLM, with dates relative to `day`
+    (default: today()). The `Acquirer Bank` column is only described when the
+    dataset has it.
+    """
+    day = day or today()
+    periods = json.dumps(time_periods(day), indent=4)
+    has_banks = get_dataset().has_column(BANK_COLUMN)
+    return f"""You are an expert Python data-analyst and payments-domain SME.
 Your job is to read natural-language questions about Pine Labs payment data and respond **only** with a short, runnable Python snippet (pandas-style) that produces the requested result from a DataFrame named `df` (already loaded from **data_cleaned.csv**).
 
-IMPORTANT:  TODAY IS 2025-05-16. Calculate all dates relative to this date if asked for any date.
+IMPORTANT:  TODAY IS {day.isoformat()}. Calculate all dates relative to this date if asked for any date.
 ─────────────────────────────
 DATA OVERVIEW
 ─────────────────────────────
@@ -75,11 +85,11 @@ The DataFrame `df` has these key columns:
 - Settlement Amount                ₹ settled
 - Bank Commision                   ₹ MDR / acquiring fee
 - Convenience Fees Amount In (Paise)
-- Acquirer Issuer Match            {1, 0}
+- Acquirer Issuer Match            {{1, 0}}
 - Payout Status                    ("PAID", "PENDING")
 - Bank Service Tax                 GST on MDR
 - Amount To Be Deducted …         extra bank charges
-- Date                             ISO "yyyy-mm-dd"
+- Date                             datetime64, parsed on load (compare with "yyyy-mm-dd" strings){BANK_COLUMN_OVERVIEW if has_banks else ""}
 
 Derived KPIs you often compute:
 
@@ -99,26 +109,21 @@ def safe_divide(numer, denom):
 ─────────────────────────────
 TIME-PERIOD CONVENTIONS
 ─────────────────────────────
-Today is 2025-05-16. Calculate all dates relative to this date.
-df["Date"] is parsed with pd.to_datetime.
-A dict called time_periods is pre-computed per request, e.g.:
-
-
-time_periods = {
-    "lw":  {"start": "2025-05-05", "end": "2025-05-11",
-            "compare_start": "2024-05-06", "compare_end": "2024-05-12"},
-    "mtd": {…},
-    "qtd": {…},
-    "ytd": {…},
-    "trailing_13_weeks": {…}
-}
+Today is {day.isoformat()}. Calculate all dates relative to this date.
+df["Date"] is already datetime64; do not parse it again.
+A dict called time_periods is pre-computed per request (all dates inclusive):
+
+time_periods = {periods}
+
 Guidelines:
 
-For "lw", "mtd", "qtd", "ytd", or "trailing 13 weeks", filter df["Date"] between start and end.
+For "lw", "mtd", "qtd", "ytd", or "trailing 13 weeks", select the rows with
+between_dates(df, start, end). df is sorted by Date, so this is a binary search
+instead of a comparison over every row; use it for any date range.
 
 For explicit weeks like "202518 week" or "5th week of this year", convert to ISO week and filter directly.
 
-When YoY comparison is required, build compare_df using compare_start and compare_end, and return percentage change columns (positive = increase, negative = decrease).
+When YoY comparison is required, build compare_df = between_dates(df, compare_start, compare_end), and return percentage change columns (positive = increase, negative = decrease).
 
 ─────────────────────────────
 CODE-STYLE RULES
@@ -128,6 +133,10 @@ Return only Python code – no extra commentary.
 
 Use pandas idioms (groupby, agg, vectorised ops).
 
+Text columns (Payment Mode Name, Transaction Status Name, Payout Status, …) are
+categoricals: always pass observed=True to groupby so values absent from the
+filtered rows are not listed with zeros.
+
 Always qualify columns: df['Settlement Amount'], not bare names.
 
 Use safe_divide for any division.
@@ -139,14 +148,17 @@ If unsure, output exactly: 'Unable to generate python snippet.'
 ─────────────────────────────
 BANK-MAPPING UTILITIES
 ─────────────────────────────
+{BANK_COLUMN_USAGE if has_banks else "To map a column of acquirer names to banks"}, call map_acquirer_series(df[col]), which maps
+each distinct value once. For reference, the mapping is:
+
 import re
 
-BANK_TOKENS = {
+BANK_TOKENS = {{
     "AXIS": "AXIS", "HDFC": "HDFC", "KOTAK": "KOTAK",
     "ICICI": "ICICI", "INDUSIND": "INDUSIND_BANK", "RBL": "RBL",
     "SCB": "STANDARD_CHARTERED_BANK", "YES": "YES",
     "PNB": "PNB", "IOB": "INDIAN_OVERSEAS_BANK"
-}
+}}
 
 def map_acquirer(acq):
     s = re.sub(r"[^A-Z]", "", str(acq).upper())
@@ -162,11 +174,9 @@ Question: "Show last-week refund rate by payment mode."
 python
 Copy
 Edit
-mask = df["Date"].between(time_periods["lw"]["start"],
-                          time_periods["lw"]["end"])
-tmp = df.loc[mask]
+tmp = between_dates(df, time_periods["lw"]["start"], time_periods["lw"]["end"])
 
-result = (tmp.groupby("Payment Mode Name")
+result = (tmp.groupby("Payment Mode Name", observed=True)
               .apply(lambda g: safe_divide(g["Refund Amount"].sum(),
                                            g["Settlement Amount"].sum()))
               .reset_index(name="refund_rate"))
@@ -174,30 +184,16 @@ result
 """
 
 
-def get_llm_response(user_input, api_key):
+async def get_llm_response(user_input, api_key):
     """Get response from LLM for the given user input."""
     system_message = get_system_message()
-    
-    messages = [
-        ("system", system_message),
-        ("human", user_input),
-    ]
-
-    llm = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        api_key=api_key
-    )
 
-    ai_msg = llm.invoke(messages)
-    return ai_msg.content
+    return await achat(system_message, user_input, model="gpt-4o", temperature=0, api_key=api_key,
+                       stage="code_generation", cache="miss")
 
 
-def get_english_response(user_question, computed_result, api_key):
-    """Generate a natural English sentence response from the user question and computed result."""
+def english_response_prompt(user_question, computed_result):
+    """Return the (system, user) prompts that turn a computed result into English."""
     system_message = """You are an expert data analyst who explains analytical results in clear, natural English.
 
 Your job is to take a user's question about payment data and the computed result, then provide a concise, professional English response that directly answers their question.
@@ -227,46 +223,101 @@ Computed Result: {computed_result}
 
 Please provide a natural English response that answers the user's question based on the computed result.
 """
-    
-    messages = [
-        ("system", system_message),
-        ("human", prompt),
-    ]
+    return system_message, prompt
+
+
+ENGLISH_RESPONSE_OPTIONS = {
+    "model": "gpt-4o",
+    "temperature": 0.3,  # Slightly higher temperature for more natural language
+    "max_tokens": 200,   # Limit response length
+}
 
-    llm = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0.3,  # Slightly higher temperature for more natural language
-        max_tokens=200,   # Limit response length
-        timeout=None,
-        max_retries=2,
-        api_key=api_key
-    )
 
-    ai_msg = llm.invoke(messages)
-    return ai_msg.content
+async def get_english_response(user_question, computed_result, api_key):
+    """Generate a natural English sentence response from the user question and computed result."""
+    system_message, prompt = english_response_prompt(user_question, computed_result)
+    return await achat(system_message, prompt, api_key=api_key, stage="english_response", **ENGLISH_RESPONSE_OPTIONS)
+
+
+async def stream_english_response(user_question, computed_result, api_key=None):
+    """Like get_english_response, but yields the answer token by token."""
+    system_message, prompt = english_response_prompt(user_question, computed_result)
+    async for token in astream_chat(system_message, prompt, api_key=api_key, stage="english_response",
+                                    **ENGLISH_RESPONSE_OPTIONS):
+        yield token
+
+
+def clean_code(code: str) -> str:
+    """Strip markdown code fences from an LLM-generated snippet."""
+    cleaned_code = code.strip()
+    if cleaned_code.startswith('```python'):
+        # Remove ```python at the start and ``` at the end
+        lines = cleaned_code.split('\n')
+        if lines[0].startswith('```'):
+            lines = lines[1:]  # Remove first line
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]  # Remove last line
+        cleaned_code = '\n'.join(lines)
+    elif cleaned_code.startswith('```'):
+        # Remove generic ``` blocks
+        lines = cleaned_code.split('\n')
+        if lines[0].startswith('```'):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]
+        cleaned_code = '\n'.join(lines)
+    return cleaned_code
+
+
+def is_execution_error(result):
+    """True if execute_llm_code reported a failure instead of a result."""
+    return isinstance(result, str) and result.startswith("Execution error:")
+
+
+def is_empty_result(result):
+    """True for None and for empty frames, series and arrays."""
+    if result is None:
+        return True
+    empty = getattr(result, "empty", None)
+    if isinstance(empty, bool):
+        return empty
+    size = getattr(result, "size", None)
+    return isinstance(size, int) and size == 0
+
+
+@lru_cache(maxsize=256)
+def compile_snippet(cleaned_code: str):
+    """
+    Parse and compile a cleaned snippet once.
+
+    Returns (initial_code, last_is_expr, last_code): the compiled statements
+    before the last one (or None), whether the last statement is an expression,
+    and the compiled last statement (eval mode if it is an expression).
+    """
+    # Parse code into AST
+    tree = ast.parse(cleaned_code)
+
+    # Separate all but the last statement (for exec) and the last (for eval)
+    *initial_stmts, last_stmt = tree.body
+
+    initial_code = None
+    if initial_stmts:
+        initial_code = compile(ast.Module(body=initial_stmts, type_ignores=[]),
+                               filename="<ast>", mode="exec")
+
+    # Handle final statement: expression or assignment
+    if isinstance(last_stmt, ast.Expr):
+        return initial_code, True, compile(ast.Expression(body=last_stmt.value),
+                                           filename="<ast>", mode="eval")
+    return initial_code, False, compile(ast.Module(body=[last_stmt], type_ignores=[]),
+                                        filename="<ast>", mode="exec")
 
 
 def execute_llm_code(code: str, df: pd.DataFrame):
     """Execute LLM-generated code with the provided DataFrame."""
     try:
         # Clean the code - remove markdown code blocks if present
-        cleaned_code = code.strip()
-        if cleaned_code.startswith('```python'):
-            # Remove ```python at the start and ``` at the end
-            lines = cleaned_code.split('\n')
-            if lines[0].startswith('```'):
-                lines = lines[1:]  # Remove first line
-            if lines and lines[-1].strip() == '```':
-                lines = lines[:-1]  # Remove last line
-            cleaned_code = '\n'.join(lines)
-        elif cleaned_code.startswith('```'):
-            # Remove generic ``` blocks
-            lines = cleaned_code.split('\n')
-            if lines[0].startswith('```'):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == '```':
-                lines = lines[:-1]
-            cleaned_code = '\n'.join(lines)
+        cleaned_code = clean_code(code)
         
         # Set up local variables with the DataFrame and utility functions
         local_vars = {
@@ -274,33 +325,29 @@ def execute_llm_code(code: str, df: pd.DataFrame):
             'pd': pd, 
             'safe_divide': safe_divide,
             'map_acquirer': map_acquirer,
+            'map_acquirer_series': map_acquirer_series,
             'BANK_TOKENS': BANK_TOKENS,
+            'time_periods': time_periods(),
+            'between_dates': between_dates,
             're': re
         }
         
-        # Parse code into AST
-        tree = ast.parse(cleaned_code)
-
-        # Separate all but the last statement (for exec) and the last (for eval)
-        *initial_stmts, last_stmt = tree.body
+        initial_code, last_is_expr, last_code = compile_snippet(cleaned_code)
 
-        # Compile and exec initial statements
-        if initial_stmts:
-            exec(compile(ast.Module(body=initial_stmts, type_ignores=[]), 
-                        filename="<ast>", mode="exec"), {}, local_vars)
+        # Run the initial statements, then evaluate the final expression (if any)
+        if initial_code is not None:
+            exec(initial_code, {}, local_vars)
 
-        # Handle final statement: expression or assignment
-        if isinstance(last_stmt, ast.Expr):
-            result = eval(compile(ast.Expression(body=last_stmt.value), 
-                                filename="<ast>", mode="eval"), {}, local_vars)
+        if last_is_expr:
+            result = eval(last_code, {}, local_vars)
         else:
-            exec(compile(ast.Module(body=[last_stmt], type_ignores=[]), 
-                        filename="<ast>", mode="exec"), {}, local_vars)
+            exec(last_code, {}, local_vars)
             result = None  # No result to return if it's an assignment
 
         return result
     except Exception as e:
-        return f"Execution error: {e}"
+        # Some exceptions (MemoryError) have an empty message; name the type instead
+        return f"Execution error: {str(e) or type(e).__name__}"
 
 
 def test_with_real_data():
@@ -343,7 +390,70 @@ avg_refund_amount
         print("Required columns (Date, Refund Amount) not found in the dataset.")
 
 
-def process_query(user_input: str, merchant: str = None, api_key: str = None):
+async def run_llm_code(code: str, merchant: str = None, df: pd.DataFrame = None):
+    """
+    Execute a snippet in the sandbox pool when it is running (deadline and
+    memory cap enforced), otherwise in a thread against `df`.
+
+    Successful results are memoized per (code hash, merchant, dataset version).
+    """
+    handle = get_dataset()
+    key = result_key(clean_code(code), merchant, handle.fingerprint or handle.version)
+    hit, result = result_cache.get(key)
+    if hit:
+        return result
+
+    if sandbox_pool.running:
+        result = await sandbox_pool.execute(code, merchant, handle.fingerprint)
+    else:
+        result = await asyncio.to_thread(execute_llm_code, code, df)
+    if not is_execution_error(result):
+        result_cache.set(key, result)
+    return result
+
+
+async def generate_insight(user_input: str, merchant: str = None, api_key: str = None):
+    """
+    Produce and run the pandas snippet for an insight question.
+
+    Returns a dict with 'llm_code', 'result' and 'code_cache_hit', or None if
+    the data could not be loaded.
+    """
+    # Load data (sandbox workers hold their own copy of the dataset)
+    with timed("data_load"):
+        df = None if sandbox_pool.running else load_data(merchant=merchant)
+    if df is None and not sandbox_pool.running:
+        return None
+
+    # Reuse a cached snippet for questions that only differ by dates,
+    # payment modes, banks or merchants; fall back to the LLM if it fails or
+    # finds nothing, since a mis-bound template tends to select no rows.
+    # Matching the question against every merchant is kept off the event loop
+    system_message = get_system_message()
+    llm_response = await asyncio.to_thread(code_cache.lookup, user_input, system_message)
+    cache_hit = llm_response is not None
+    if cache_hit:
+        with timed("execute"):
+            result = await run_llm_code(llm_response, merchant, df)
+        cache_hit = not is_execution_error(result) and not is_empty_result(result)
+        if cache_hit:
+            record_cache_hit("code_generation", system_message, user_input)
+
+    if not cache_hit:
+        # Get LLM response
+        with timed("code_generation"):
+            llm_response = clean_code(await get_llm_response(user_input, api_key))
+
+        # Execute the code (out of the event loop, it can be CPU-heavy)
+        with timed("execute"):
+            result = await run_llm_code(llm_response, merchant, df)
+        if not is_execution_error(result) and not is_empty_result(result):
+            await asyncio.to_thread(code_cache.store, user_input, system_message, llm_response)
+
+    return {"llm_code": llm_response, "result": result, "code_cache_hit": cache_hit}
+
+
+async def process_query(user_input: str, merchant: str = None, api_key: str = None):
     """
     Process a user query and return structured response with code, result, and English explanation.
     
@@ -367,9 +477,8 @@ def process_query(user_input: str, merchant: str = None, api_key: str = None):
                     "english_response": None
                 }
         
-        # Load data
-        df = load_data(merchant=merchant)
-        if df is None:
+        insight = await generate_insight(user_input, merchant, api_key)
+        if insight is None:
             return {
                 "success": False,
                 "error": "Failed to load data",
@@ -377,21 +486,18 @@ def process_query(user_input: str, merchant: str = None, api_key: str = None):
                 "result": None,
                 "english_response": None
             }
-        
-        # Get LLM response
-        llm_response = get_llm_response(user_input, api_key)
-        
-        # Execute the code
-        result = execute_llm_code(llm_response, df)
+        result = insight["result"]
         
         # Generate English response
-        english_response = get_english_response(user_input, result, api_key)
+        with timed("narrative"):
+            english_response = await get_english_response(user_input, result, api_key)
         
         return {
             "success": True,
-            "llm_code": llm_response,
+            "llm_code": insight["llm_code"],
             "result": str(result),  # Convert to string for JSON serialization
             "english_response": english_response,
+            "code_cache_hit": insight["code_cache_hit"],
             "error": None
         }
         
@@ -411,7 +517,7 @@ if __name__ == "__main__":
     user_input = "What was the average time-to-capture for UPI transactions on May 5th?"
     
     # Process the query (API key will be read from environment variable)
-    response = process_query(user_input)
+    response = asyncio.run(process_query(user_input))
     
     if response["success"]:
         print(f"LLM Generated Code:\n{response['llm_code']}")
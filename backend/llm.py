@@ -0,0 +1,238 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+import weakref
+from functools import lru_cache, partial
+
+import httpx
+from openai import NOT_GIVEN, AsyncOpenAI, OpenAI
+from dotenv import load_dotenv
+
+from .llm_usage import LLMCall, usage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Maximum LLM requests in flight per process, and HTTP connection pool sizing
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+LLM_KEEPALIVE_SECONDS = float(os.environ.get("LLM_KEEPALIVE_SECONDS", 120))
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 120))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+
+# Models whose tiktoken encodings load_encodings fetches at startup
+TOKENIZER_MODELS = ["gpt-4o", "gpt-4"]
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(model):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline hosts fall back to an estimate
+        logger.warning(f"No tiktoken encoding for {model} ({e}); estimating token counts from length")
+        return None
+
+
+_encoding_lock = threading.Lock()
+
+
+def _encoding(model):
+    # One download per encoding, however many threads count tokens at once
+    with _encoding_lock:
+        return _load_encoding(model)
+
+
+def load_encodings(models=TOKENIZER_MODELS):
+    """
+    Load the tiktoken encodings of `models` (blocking: the first load
+    downloads the BPE files unless TIKTOKEN_CACHE_DIR already holds them).
+    Call it at startup, off the event loop.
+    """
+    for model in models:
+        _encoding(model)
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Tokens `text` takes for `model`, via tiktoken (about 4 characters per
+    token without it). Blocking on first use of an encoding, so async code
+    counts through `_record_later`.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+    )
+
+
+_lock = threading.Lock()
+_sync_clients = {}
+# Async clients and semaphores are bound to the event loop they were created on
+_async_state = weakref.WeakKeyDictionary()
+
+
+def get_client(api_key=None):
+    """Return the process-wide blocking OpenAI client (pooled, keep-alive connections)"""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    with _lock:
+        client = _sync_clients.get(api_key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                max_retries=LLM_MAX_RETRIES,
+                timeout=LLM_TIMEOUT_SECONDS,
+                http_client=httpx.Client(limits=_limits(), timeout=LLM_TIMEOUT_SECONDS),
+            )
+            _sync_clients[api_key] = client
+    return client
+
+
+def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        state = {"clients": {}, "semaphore": asyncio.Semaphore(LLM_MAX_CONCURRENCY)}
+        _async_state[loop] = state
+    return state
+
+
+def get_async_client(api_key=None):
+    """Return the shared AsyncOpenAI client for the running event loop"""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    clients = _loop_state()["clients"]
+    client = clients.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=LLM_MAX_RETRIES,
+            timeout=LLM_TIMEOUT_SECONDS,
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=LLM_TIMEOUT_SECONDS),
+        )
+        clients[api_key] = client
+    return client
+
+
+def _messages(system_prompt, user_prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _record(stage, model, latency_ms, prompt, text, usage_report=None, cache=None, streamed=False, error=None):
+    usage.record(LLMCall(
+        stage=stage,
+        model=model,
+        latency_ms=latency_ms,
+        prompt_tokens_est=count_tokens(prompt, model),
+        completion_tokens_est=count_tokens(text, model) if text else 0,
+        prompt_tokens=getattr(usage_report, "prompt_tokens", None),
+        completion_tokens=getattr(usage_report, "completion_tokens", None),
+        cache=cache,
+        streamed=streamed,
+        error=error,
+    ))
+
+
+def _record_later(*args, **kwargs):
+    """
+    `_record` in the default executor when called on an event loop: counting
+    tokens is CPU work (and can block on loading an encoding), so it is kept
+    off the loop
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _record(*args, **kwargs)
+        return
+    # Copy the context so the call still lands in the request's trace
+    loop.run_in_executor(None, contextvars.copy_context().run, partial(_record, *args, **kwargs))
+
+
+def record_cache_hit(stage, system_prompt, user_prompt, model="gpt-4o"):
+    """Record an LLM call that a cache answered instead of the API"""
+    _record_later(stage, model, 0.0, system_prompt + user_prompt, None, cache="hit")
+
+
+async def achat(system_prompt, user_prompt, model="gpt-4o", temperature=0, max_tokens=None, api_key=None,
+                stage="chat", cache=None):
+    """
+    Send one chat completion through the shared async client and return its text.
+
+    The call is recorded in backend.llm_usage under `stage`; `cache` ("miss")
+    marks calls made because a cache had no answer.
+    """
+    client = get_async_client(api_key)
+    started = time.perf_counter()
+    text, usage_report, error = None, None, None
+    try:
+        async with _loop_state()["semaphore"]:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=_messages(system_prompt, user_prompt),
+                temperature=temperature,
+                max_tokens=NOT_GIVEN if max_tokens is None else max_tokens,
+            )
+        text, usage_report = response.choices[0].message.content, response.usage
+        return text
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        _record_later(stage, model, (time.perf_counter() - started) * 1000, system_prompt + user_prompt, text,
+                      usage_report, cache, error=error)
+
+
+async def astream_chat(system_prompt, user_prompt, model="gpt-4o", temperature=0, max_tokens=None, api_key=None,
+                       stage="chat"):
+    """Stream one chat completion, yielding text deltas as they arrive (recorded like `achat`)"""
+    client = get_async_client(api_key)
+    started = time.perf_counter()
+    parts, usage_report, error = [], None, None
+    try:
+        async with _loop_state()["semaphore"]:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=_messages(system_prompt, user_prompt),
+                temperature=temperature,
+                max_tokens=NOT_GIVEN if max_tokens is None else max_tokens,
+                stream=True,
+                # The last chunk then carries the token usage of the whole completion
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage_report = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        _record_later(stage, model, (time.perf_counter() - started) * 1000, system_prompt + user_prompt, "".join(parts),
+                      usage_report, streamed=True, error=error)
+
+
+async def aclose():
+    """Close the async clients of the running event loop (call on shutdown)"""
+    clients = _loop_state()["clients"]
+    for client in clients.values():
+        await client.close()
+    clients.clear()
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from .metrics import register_cache
+
+load_dotenv()
+
+# Optional SQLite file that keeps cached LLM answers across restarts
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH")
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 4096))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+
+def normalize_question(question):
+    """Lower-case, collapse whitespace and drop spaces before punctuation"""
+    text = re.sub(r"\s+", " ", str(question).strip().lower())
+    return re.sub(r"\s+([?.!,])", r"\1", text)
+
+
+def prompt_version(prompt):
+    """Short hash of a prompt; editing the prompt invalidates its cached answers"""
+    return hashlib.sha256(prompt.encode()).hexdigest()[:12]
+
+
+class ResponseCache:
+    """
+    Cache of LLM answers keyed by (namespace, prompt version, normalized question).
+
+    An in-memory LRU sits in front of an optional SQLite store at `path`, so
+    answers survive restarts. Entries older than `ttl_seconds` are treated as
+    misses. `hits`/`misses` count lookups since start-up.
+    """
+    def __init__(self, namespace, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS, path=LLM_CACHE_PATH):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def key(self, prompt, question):
+        return f"{self.namespace}:{prompt_version(prompt)}:{normalize_question(question)}"
+
+    def get(self, prompt, question):
+        """Return the cached answer, or None on a miss"""
+        key = self.key(prompt, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, entry)
+            if entry is None or now - entry[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, prompt, question, value):
+        key = self.key(prompt, question)
+        entry = (value, time.time())
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, *entry))
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+classification_cache = register_cache("classify", ResponseCache("classify"))
+kpi_cache = register_cache("kpi", ResponseCache("kpi"))
@@ -0,0 +1,175 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Completed request traces kept for /llm/traces
+LLM_TRACE_HISTORY = int(os.environ.get("LLM_TRACE_HISTORY", 200))
+# Recent latencies kept per (stage, model) for the percentiles in /llm/usage
+LLM_LATENCY_WINDOW = int(os.environ.get("LLM_LATENCY_WINDOW", 1000))
+
+
+@dataclass
+class LLMCall:
+    """
+    One LLM call (or a cache hit that replaced one).
+
+    `*_tokens_est` are tiktoken counts of the prompt and the answer;
+    `prompt_tokens`/`completion_tokens` are what the API reported (None when it
+    did not, e.g. cache hits). `cache` is "hit", "miss" or None for uncached
+    call sites.
+    """
+    stage: str
+    model: str
+    latency_ms: float
+    prompt_tokens_est: int
+    completion_tokens_est: int = 0
+    prompt_tokens: int = None
+    completion_tokens: int = None
+    cache: str = None
+    streamed: bool = False
+    error: str = None
+    started_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class Trace:
+    """The LLM calls made while serving one request"""
+    request_id: str
+    path: str = ""
+    started_at: float = field(default_factory=time.time)
+    calls: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {
+            "request_id": self.request_id,
+            "path": self.path,
+            "started_at": self.started_at,
+            "llm_latency_ms": sum(call.latency_ms for call in self.calls),
+            "prompt_tokens": sum(call.prompt_tokens or call.prompt_tokens_est for call in self.calls if call.cache != "hit"),
+            "completion_tokens": sum(call.completion_tokens or call.completion_tokens_est for call in self.calls if call.cache != "hit"),
+            "calls": [asdict(call) for call in self.calls],
+        }
+
+
+class _Aggregate:
+    def __init__(self, window=LLM_LATENCY_WINDOW):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_tokens_est = 0
+        self.completion_tokens_est = 0
+        self.latency_ms = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def add(self, call):
+        self.calls += 1
+        if call.cache == "hit":
+            self.cache_hits += 1
+            return
+        self.errors += call.error is not None
+        # Prefer the API's own counts and fall back to the estimate
+        self.prompt_tokens += call.prompt_tokens if call.prompt_tokens is not None else call.prompt_tokens_est
+        self.completion_tokens += call.completion_tokens if call.completion_tokens is not None else call.completion_tokens_est
+        self.prompt_tokens_est += call.prompt_tokens_est
+        self.completion_tokens_est += call.completion_tokens_est
+        self.latency_ms += call.latency_ms
+        self.latencies.append(call.latency_ms)
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        api_calls = self.calls - self.cache_hits
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))] if latencies else 0.0
+
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prompt_tokens_est": self.prompt_tokens_est,
+            "completion_tokens_est": self.completion_tokens_est,
+            "latency_ms_total": self.latency_ms,
+            "latency_ms_mean": self.latency_ms / api_calls if api_calls else 0.0,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+        }
+
+
+class UsageRecorder:
+    """
+    Process-wide accounting of LLM calls.
+
+    Every call is added to per-(stage, model) aggregates and, when a trace is
+    active in the current context (see `trace`), to that request's trace.
+    Traces with at least one call are kept in a ring buffer of `history` entries.
+    """
+    def __init__(self, history=LLM_TRACE_HISTORY):
+        self._lock = threading.Lock()
+        self._aggregates = {}
+        self._traces = deque(maxlen=history)
+        self._current = contextvars.ContextVar("llm_trace", default=None)
+
+    def record(self, call):
+        with self._lock:
+            self._aggregates.setdefault((call.stage, call.model), _Aggregate()).add(call)
+        current = self._current.get()
+        if current is not None:
+            # A trace enters the history with its first call, so calls made
+            # while a streamed response is still being sent are kept too
+            if not current.calls:
+                with self._lock:
+                    self._traces.append(current)
+            current.calls.append(call)
+
+    @contextmanager
+    def trace(self, request_id=None, path=""):
+        """Collect the LLM calls made in this context (and tasks/threads it starts) into one Trace"""
+        current = Trace(request_id=request_id or uuid.uuid4().hex[:16], path=path)
+        token = self._current.set(current)
+        try:
+            yield current
+        finally:
+            self._current.reset(token)
+
+    def current_trace(self):
+        return self._current.get()
+
+    def stats(self):
+        """Aggregates per stage and model, plus overall totals"""
+        with self._lock:
+            by_stage = {f"{stage}/{model}": agg.as_dict() for (stage, model), agg in sorted(self._aggregates.items())}
+            total = _Aggregate(window=None)
+            for agg in self._aggregates.values():
+                for name in ("calls", "cache_hits", "errors", "prompt_tokens", "completion_tokens",
+                             "prompt_tokens_est", "completion_tokens_est", "latency_ms"):
+                    setattr(total, name, getattr(total, name) + getattr(agg, name))
+                total.latencies.extend(agg.latencies)
+        return {"total": total.as_dict(), "stages": by_stage}
+
+    def traces(self, limit=50):
+        """Most recent request traces, newest first"""
+        with self._lock:
+            recent = list(self._traces)[-limit:]
+        return [t.as_dict() for t in reversed(recent)]
+
+    def reset(self):
+        with self._lock:
+            self._aggregates.clear()
+            self._traces.clear()
+
+
+usage = UsageRecorder()
+
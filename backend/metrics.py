@@ -0,0 +1,205 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from .llm_usage import usage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets exposed on /metrics
+METRICS_BUCKETS = [float(b) for b in os.environ.get(
+    "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+).split(",")]
+
+# Stage timings collected while running in a worker process, see `collect_stages`
+_collected = contextvars.ContextVar("collected_stages", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            counts, total = self._series.get(labelvalues, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[labelvalues] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labelvalues, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket", _labels(self.labelnames + ("le",), labelvalues + (le,)), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labelvalues), total
+            yield f"{self.name}_count", _labels(self.labelnames, labelvalues), cumulative
+
+
+class Gauge:
+    """
+    Gauge in the Prometheus text format. With `function` the value is read at
+    scrape time; otherwise it is moved with inc/dec/set. With `labelnames`,
+    `function` returns {label values: value}, one series per entry.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function=None, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        if self.labelnames:
+            for labelvalues, value in sorted(self.function().items()):
+                yield self.name, _labels(self.labelnames, labelvalues), value
+            return
+        yield self.name, "", self.function() if self.function is not None else self._value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.register(Histogram(
+    "pipeline_stage_seconds", "Time spent in each stage of the query pipeline", ["stage"]))
+request_seconds = registry.register(Histogram(
+    "http_request_seconds", "HTTP request latency until the response starts", ["method", "path", "status"]))
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"))
+
+# In-process caches whose stats() are exposed on /metrics, see `register_cache`
+_caches = {}
+
+
+def register_cache(name, cache):
+    """Expose `cache.stats()` (hits, misses, entries and, if reported, bytes) labelled cache=`name`"""
+    _caches[name] = cache
+    return cache
+
+
+def _cache_stat(field):
+    stats = {name: cache.stats() for name, cache in list(_caches.items())}
+    return {(name,): values[field] for name, values in stats.items() if field in values}
+
+
+cache_hits = registry.register(Gauge(
+    "cache_hits", "Lookups answered from each in-process cache since start-up",
+    lambda: _cache_stat("hits"), ["cache"]))
+cache_misses = registry.register(Gauge(
+    "cache_misses", "Lookups each in-process cache could not answer since start-up",
+    lambda: _cache_stat("misses"), ["cache"]))
+cache_entries = registry.register(Gauge(
+    "cache_entries", "Entries held by each in-process cache", lambda: _cache_stat("entries"), ["cache"]))
+cache_bytes = registry.register(Gauge(
+    "cache_bytes", "Estimated bytes held by the caches that track their size",
+    lambda: _cache_stat("bytes"), ["cache"]))
+
+
+def request_id():
+    """The X-Request-ID of the request being served in this context, or '-'"""
+    trace = usage.current_trace()
+    return trace.request_id if trace is not None else "-"
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds `request_id` to log records so handlers can format it"""
+    def filter(self, record):
+        record.request_id = request_id()
+        return True
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    collected = _collected.get()
+    if collected is not None:
+        collected.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as one `stage` of the pipeline"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe_stage(stage, seconds)
+        logger.debug(f"{stage} took {seconds * 1000:.1f}ms")
+
+
+@contextmanager
+def collect_stages():
+    """
+    Also collect the stages timed in this context as [(stage, seconds)], so a
+    worker process can hand them back to the API process (see `replay_stages`)
+    """
+    collected = []
+    token = _collected.set(collected)
+    try:
+        yield collected
+    finally:
+        _collected.reset(token)
+
+
+def replay_stages(stages):
+    for stage, seconds in stages:
+        observe_stage(stage, seconds)
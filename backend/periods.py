@@ -0,0 +1,70 @@
+import os
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+from .dataset import get_dataset
+
+load_dotenv()
+
+# "Today" for relative dates (last week, MTD, ...) in questions and generated
+# code: an ISO date, or "latest" for the last date in the dataset
+TIME_PERIODS_TODAY = os.environ.get("TIME_PERIODS_TODAY", "2025-05-16")
+
+# Week-based periods are compared with the same ISO weeks a year earlier
+# (52 weeks back, so weekdays line up); to-date periods with the same dates
+WEEKS_PER_YEAR = 52
+
+
+def today(handle=None):
+    """The reporting date that time periods are relative to"""
+    if TIME_PERIODS_TODAY == "latest":
+        handle = handle or get_dataset()
+        if handle.last_date is not None:
+            return handle.last_date
+        return date.today()
+    return date.fromisoformat(TIME_PERIODS_TODAY)
+
+
+def year_earlier(day):
+    """The same calendar date a year before (29 February maps to the 28th)"""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+
+def _period(start, end, compare_start, compare_end):
+    return {"start": start.isoformat(), "end": end.isoformat(),
+            "compare_start": compare_start.isoformat(), "compare_end": compare_end.isoformat()}
+
+
+def _weeks(start, end):
+    shift = timedelta(weeks=WEEKS_PER_YEAR)
+    return _period(start, end, start - shift, end - shift)
+
+
+def _to_date(start, end):
+    return _period(start, end, year_earlier(start), year_earlier(end))
+
+
+def time_periods(day=None):
+    """
+    The `time_periods` dict handed to generated snippets, relative to `day`
+    (default: `today()`). Each period has inclusive ISO `start`/`end` dates
+    and the `compare_start`/`compare_end` of its year-over-year window:
+
+    - lw: the last complete Monday-Sunday week
+    - mtd, qtd, ytd: from the first day of the month/quarter/year to `day`
+    - trailing_13_weeks: the 13 complete weeks ending with lw
+    """
+    day = day or today()
+    week_start = day - timedelta(days=day.weekday())
+    last_week_end = week_start - timedelta(days=1)
+    return {
+        "lw": _weeks(week_start - timedelta(weeks=1), last_week_end),
+        "mtd": _to_date(day.replace(day=1), day),
+        "qtd": _to_date(date(day.year, 3 * ((day.month - 1) // 3) + 1, 1), day),
+        "ytd": _to_date(date(day.year, 1, 1), day),
+        "trailing_13_weeks": _weeks(week_start - timedelta(weeks=13), last_week_end),
+    }
@@ -1,20 +1,108 @@
+import asyncio
+import json
+import logging
 import os
-from token import OP
-from openai import OpenAI
-from .prompts import EXTRACT_KPI_PROMPT, CLASSIFY_QUESTION_PROMPT, FALLBACK_PROMPT
-from .assistant import DataAnalysisAssistant
-from .execute_llm import process_query
+import re
+import time
+from .prompts import EXTRACT_KPI_PROMPT, CLASSIFY_QUESTION_PROMPT, CLASSIFY_QUESTIONS_BATCH_PROMPT, FALLBACK_PROMPT
+from .assistant import assistant_pool
+from .execute_llm import generate_insight, process_query, stream_english_response
+from .dataset import get_dataset
+from .causal import CAUSAL_KPIS, attribute_distribution_change
+from .llm import achat, astream_chat, record_cache_hit
+from .llm_cache import classification_cache, kpi_cache
+from .metrics import timed
 from dotenv import load_dotenv
-import networkx as nx
-from dowhy import gcm
-import pandas as pd
-import numpy as np
 
 load_dotenv()
 
-def call_openai_api(system_prompt, user_prompt, model="gpt-4o", max_tokens=500, temperature=0):
+logger = logging.getLogger(__name__)
+
+# Maximum batch items answered concurrently by BusinessAssistant.aquery_batch
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+
+# Answer questions the local rules recognise without the LLM (0 to disable)
+LOCAL_CLASSIFIER = os.environ.get("LOCAL_CLASSIFIER", "1") != "0"
+
+# Vocabulary that marks a question as being about the payments business
+BUSINESS_TERMS = re.compile(
+    r"\b(refund\w*|settle\w*|transaction\w*|txns?|payments?|upi|cards?|net ?banking|wallet|emi|"
+    r"banks?|acquirer\w*|issuer|gmv|revenue|sales|merchants?|success ?rate|fail\w*|captured|"
+    r"mdr|commission|commision|fees?|tax|payouts?|chargebacks?|amounts?|volume|ticket size|"
+    r"time to (complete|capture)|declin\w*|response code|kpis?)\b"
+)
+CAUSAL_CUES = re.compile(
+    r"^why\b|\bwhy (did|is|are|was|were|do|does|has|have)\b|\bwhat (caused|causes|drove|drives|led to|is driving|explains)\b|"
+    r"\broot cause|\breasons? (for|behind)\b|\b(factors|drivers) (behind|that|influenc\w*|affect\w*|driving)\b|"
+    r"\bcontribut\w* to\b|\bexplain why\b|\bdue to what\b"
+)
+INSIGHT_CUES = re.compile(
+    r"^(what|how many|how much|show|list|give|get|compare|which|when|total|average|avg|top|count|find|display|plot)\b"
+)
+
+# The answers CLASSIFY_QUESTION_PROMPT allows; anything else is not cached
+CLASSIFICATION_LABELS = {"causal", "insight", "other"}
+# Used when neither the LLM nor the local rules can classify a question
+DEFAULT_CLASSIFICATION = "other"
+
+# KPI attributed when the KPI extraction answer names none of CAUSAL_KPIS
+DEFAULT_CAUSAL_KPI = CAUSAL_KPIS[0]
+
+
+def normalize_label(response):
+    return str(response).strip().strip('"').lower()
+
+
+def is_label(response):
+    """Whether an LLM classification answer is one of CLASSIFICATION_LABELS"""
+    return normalize_label(response) in CLASSIFICATION_LABELS
+
+
+def fallback_label(question):
+    """Label for a question the LLM could not classify: the local rules' answer, else DEFAULT_CLASSIFICATION"""
+    return classify_locally(question) or DEFAULT_CLASSIFICATION
+
+
+def classify_locally(question):
+    """
+    Rule-based classifier for the CLASSIFY_QUESTION_PROMPT categories.
+
+    The rules are deterministic: a question either matches them and gets a
+    label, or does not and gets None (left to the LLM); there is no
+    confidence score. Causal cues ("why", "what caused", ...) win over
+    insight cues ("what", "how many", "show", ...); a question without any
+    payments vocabulary is never decided locally, since telling "other" apart
+    needs the LLM.
+    """
+    text = re.sub(r"\s+", " ", str(question).strip().lower())
+    if not BUSINESS_TERMS.search(text):
+        return None
+    if CAUSAL_CUES.search(text):
+        return "causal"
+    if INSIGHT_CUES.search(text):
+        return "insight"
+    return None
+
+
+def parse_kpis(text, default=()):
+    """
+    KPI names from an EXTRACT_KPI_PROMPT answer such as
+    '"Refund Amount", "Settlement Amount"', in the order they appear. Only
+    CAUSAL_KPIS are returned (anything else is not a node of the causal
+    graph); an answer naming none of them gives `default`.
+    """
+    lowered = str(text or "").lower()
+    found = sorted((lowered.find(kpi.lower()), kpi) for kpi in CAUSAL_KPIS if kpi.lower() in lowered)
+    if found:
+        return [kpi for _, kpi in found]
+    if default:
+        logger.warning(f"KPI extraction named no known KPI ({text!r}), attributing {', '.join(default)}")
+    return list(default)
+
+
+async def call_openai_api(system_prompt, user_prompt, model="gpt-4o", max_tokens=500, temperature=0, stage="chat", cache=None):
     """
-    Call OpenAI API with system and user prompts
+    Call OpenAI API with system and user prompts through the shared async client
     
     Args:
         system_prompt (str): The system message to set AI behavior
@@ -22,30 +110,41 @@ def call_openai_api(system_prompt, user_prompt, model="gpt-4o", max_tokens=500,
         model (str): OpenAI model to use (default: "gpt-4")
         max_tokens (int): Maximum tokens in response (default: 500)
         temperature (float): Response creativity 0.0-2.0 (default: 0.7)
+        stage (str): Call site name for LLM usage accounting
+        cache (str): "miss" when called because a cache had no answer
     
     Returns:
         str: AI response content or error message
     """
     try:
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        
-        return response.choices[0].message.content
+        return await achat(system_prompt, user_prompt, model=model, max_tokens=max_tokens, temperature=temperature,
+                           stage=stage, cache=cache)
     
     except Exception as e:
         return f"Error: {e}"
 
 
 
+async def cached_openai_api(cache, system_prompt, user_prompt, valid=None):
+    """
+    call_openai_api behind a ResponseCache; error strings, and responses
+    rejected by the optional `valid` predicate, are never cached.
+    Usage is recorded under the cache's namespace as the stage.
+    """
+    cached = cache.get(system_prompt, user_prompt)
+    if cached is not None:
+        record_cache_hit(cache.namespace, system_prompt, user_prompt)
+        return cached
+    response = await call_openai_api(system_prompt, user_prompt, stage=cache.namespace, cache="miss")
+    if response is not None and not response.startswith("Error:") and (valid is None or valid(response)):
+        cache.set(system_prompt, user_prompt, response)
+    return response
+
+
+CAUSAL_REPORT_SYSTEM_PROMPT = "You are a financial analyst and payment systems expert providing business insights."
+CAUSAL_REPORT_OPTIONS = {"model": "gpt-4", "temperature": 0.7, "max_tokens": 1000}
+
+
 class BusinessAssistant:
     """
     Initialize the BusinessAssistant class
@@ -53,159 +152,279 @@ class BusinessAssistant:
     def __init__(self):
         pass
 
-    def fallback(self, question):
+    async def fallback(self, question):
         """
         Fallback response when the question is not related to business, finance, transactions, payments, or data analysis
         """
-        return call_openai_api(FALLBACK_PROMPT, question)
+        return await call_openai_api(FALLBACK_PROMPT, question, stage="fallback")
+
+    async def classify_question(self, question):
+        """
+        Classify the question into causal or insight.
 
-    def classify_question(self, question):
+        Questions matched by `classify_locally` are answered locally; the rest
+        go to the LLM (cached per normalized question). A failed call or an
+        answer that is not a label gives `fallback_label`.
         """
-        Classify the question into causal or insight
+        label = classify_locally(question) if LOCAL_CLASSIFIER else None
+        if label is not None:
+            return label
+        response = await cached_openai_api(classification_cache, CLASSIFY_QUESTION_PROMPT, question, valid=is_label)
+        if not is_label(response):
+            logger.warning(f"Could not classify {question!r} ({response!r}); using {fallback_label(question)!r}")
+            return fallback_label(question)
+        return normalize_label(response)
+
+    async def classify_questions(self, questions):
         """
-        return call_openai_api(CLASSIFY_QUESTION_PROMPT, question)
+        Classify several questions with at most one LLM call.
+
+        Local and cached classifications are used first; the remaining
+        questions are sent together with CLASSIFY_QUESTIONS_BATCH_PROMPT. If the
+        batch answer cannot be parsed, they are classified one by one; if the
+        call fails, or a batch answer is not a label, they get
+        `fallback_label`. Returns {question: classification}; only valid
+        labels are cached, so a failed call is retried next time.
+        """
+        labels, pending = {}, []
+        for question in dict.fromkeys(questions):
+            label = classify_locally(question) if LOCAL_CLASSIFIER else None
+            if label is None:
+                label = classification_cache.get(CLASSIFY_QUESTION_PROMPT, question)
+                if label is not None:
+                    record_cache_hit(classification_cache.namespace, CLASSIFY_QUESTION_PROMPT, question)
+            if label is None:
+                pending.append(question)
+            else:
+                labels[question] = normalize_label(label)
+
+        if len(pending) == 1:
+            labels[pending[0]] = await self.classify_question(pending[0])
+        elif pending:
+            numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(pending, 1))
+            response = await call_openai_api(CLASSIFY_QUESTIONS_BATCH_PROMPT, numbered, max_tokens=10 * len(pending) + 20,
+                                             stage="classify_batch", cache="miss")
+            if response is None or response.startswith("Error:"):
+                logger.warning(f"Batch classification failed ({response!r}); using the local rules")
+                batch = [fallback_label(question) for question in pending]
+            else:
+                try:
+                    batch = json.loads(response.strip().removeprefix("```json").strip("` \n"))
+                    if not isinstance(batch, list) or len(batch) != len(pending):
+                        raise ValueError("label count mismatch")
+                except ValueError:  # includes json.JSONDecodeError
+                    batch = await asyncio.gather(*(self.classify_question(q) for q in pending))
+                else:
+                    for question, label in zip(pending, batch):
+                        if is_label(label):
+                            classification_cache.set(CLASSIFY_QUESTION_PROMPT, question, normalize_label(label))
+            for question, label in zip(pending, batch):
+                labels[question] = normalize_label(label) if is_label(label) else fallback_label(question)
+        return labels
     
-    def kpi_extraction(self, question):
+    async def kpi_extraction(self, question):
         """
-        Extract KPI from the business question
+        Extract KPI from the business question (cached per normalized
+        question, unless the answer names no known KPI)
         """
-        return call_openai_api(EXTRACT_KPI_PROMPT, question)
+        return await cached_openai_api(kpi_cache, EXTRACT_KPI_PROMPT, question, valid=lambda r: bool(parse_kpis(r)))
 
 
     def run_insight(self, question):
-        """Example of how to use the assistant for specific questions"""
-        analyzer = DataAnalysisAssistant()
-        
-        # Setup
-        analyzer.create_assistant()
-        analyzer.create_thread()
-        analyzer.upload_file("data/data_cleaned.csv")
-        
-        # Ask multiple questions
-        
-        
+        """
+        Answer a question with the code-interpreter assistant. Assistants and
+        the dataset upload are reused across questions (see AssistantPool);
+        only the thread is per question.
+        """
         print(f"\n📊 Question : {question}")
-        response = analyzer.ask_question_with_detailed_steps(question)
+        response = assistant_pool.ask(question, show_steps=True)
         print("-" * 80)
-        
-        analyzer.cleanup()
 
         return response
 
+    def causal_report_prompt(self, attribution_scores):
+        """
+        Build one narrative prompt for the attribution scores of one or more
+        KPIs, given as {kpi: {factor: score}}
+        """
+        kpis = list(attribution_scores)
+        # Convert attribution scores to a more readable format
+        formatted_scores = "\n\n".join(
+            f"{kpi}:\n" + "\n".join([f"{k}: {float(v):.2f}" for k, v in scores.items()])
+            for kpi, scores in attribution_scores.items()
+        )
+
+        # Craft a detailed prompt for GPT
+        prompt = f"""You are a financial analyst and data scientist specializing in payment systems and transaction analysis. 
+        I have attribution scores from a causal analysis of our payment system, showing how different factors contribute to changes in {" and ".join(kpis)}.
+
+        The scores represent the causal impact of each variable on each of these KPIs, where the magnitude shows the strength of the impact
+
+        Here are the attribution scores:
+        {formatted_scores}
+
+        Please provide a detailed business analysis that:
+        1. Identifies the most significant factors affecting {" and ".join(kpis)}. Only include the top 2 factors for each. 
+        2. Explains what these relationships mean in business terms.
+        3. Suggests actionable recommendations based on these findings
+        4. Discusses potential implications for risk management and process optimization
+
+        Focus on practical insights that would be valuable for:
+        - Risk Management Teams
+        - Payment Operations
+        - Customer Service
+        - Business Strategy
+
+        Please structure your response in clear sections and use specific examples where possible.
+        These insights have to be given to CEO of pine labs so make sure there is no technical jargon. Also, do not include any actual attribution numbers. 
+        """
+
+        return prompt
+
+    async def causal_report(self, attribution_scores):
+        """
+        Turn causal attribution scores ({kpi: {factor: score}}) into a single business narrative
+        """
+        # Make the API call
+        response_ = await achat(CAUSAL_REPORT_SYSTEM_PROMPT, self.causal_report_prompt(attribution_scores),
+                                stage="causal_report", **CAUSAL_REPORT_OPTIONS)
+        return str(response_)
+
+    async def attribute(self, merchant, kpis, causal_pool=None):
+        """
+        Run the causal attribution of `kpis` in `causal_pool` if given,
+        otherwise in a thread. Returns one AttributionResult per KPI.
+        """
+        handle = get_dataset()
+        if causal_pool is not None:
+            return await causal_pool.attribute(merchant, kpis, handle.fingerprint)
+        return await asyncio.to_thread(attribute_distribution_change, handle, merchant, kpis)
+
     def query(self, question, merchant):
         """
-        Query the business assistant
+        Query the business assistant (blocking wrapper around `aquery` for scripts)
+        """
+        return asyncio.run(self.aquery(question, merchant))
+
+    async def aquery(self, question, merchant, causal_pool=None, classification=None):
+        """
+        Query the business assistant without blocking the event loop.
+
+        LLM calls go through the shared async client; the CPU-bound causal
+        attribution runs in `causal_pool` (a backend.workers.CausalPool) when
+        one is given, otherwise in a thread. Pass `classification` to skip the
+        classification step.
+        """
+        answer = await self.answer(question, merchant, causal_pool, classification)
+        return answer["response"]
+
+    async def answer(self, question, merchant, causal_pool=None, classification=None):
+        """
+        Like `aquery`, but returns {"classification", "response", "attribution"},
+        where `attribution` is the list of AttributionResults of a causal
+        question (one per KPI, with scores, confidence intervals and sample
+        count) and None otherwise.
         """
-        classification = self.classify_question(question)
+        if classification is None:
+            with timed("classification"):
+                classification = await self.classify_question(question)
 
+        attribution = None
         if classification == "causal":
-            kpi = self.kpi_extraction(question)
-            kpi = kpi.strip("\"")
-            data = pd.read_csv('data/data_cleaned.csv')
-            data = data[data['Merchant Display Name'] == merchant]
-            df=data.copy()
-            data.drop(columns='Convenience Fees Amount In (Paise)', inplace=True)
-            data.drop(columns='Pine Payment Gateway Integration Mode Name', inplace=True)
-            data.dropna(inplace=True)
-
-            # Encode non-numeric columns except date
-            categorical_columns = ['Payment Mode Name', 'Transaction Status Name', 'Acquirer Response Code', 'Acquirer Issuer Match', 'Payout Status']
-
-            for col in categorical_columns:
-                data[col] = pd.Categorical(data[col]).codes
-
-            # Create a DAG using networkx
-            G = nx.DiGraph()
-
-            # Add nodes and edges based on the whiteboard diagram
-            G.add_edges_from([
-                ("Acquirer Issuer Match", "Refund Amount"),
-                ("Payment Mode Name", "Refund Amount"),
-                ("Transaction Status Name", "Refund Amount"),
-                ("Acquirer Response Code", "Refund Amount"),
-                ("Time To Complete", "Refund Amount"),
-                # ("Pine Payment Gateway Integration Mode Name", "Refund Amount"),
-
-                ("Refund Amount", "Settlement Amount"),
-
-                ("Bank Commision", "Settlement Amount"),
-                # ("Convenience Fees Amount In (Paise)", "settlement_amount"),
-                ("Amount To Be Deducted In Addition To Bank Charges", "Settlement Amount"),
-                ("Bank Service Tax", "Settlement Amount")
-            ])
-
-            causal_model = gcm.InvertibleStructuralCausalModel(G) 
-
-            sample1 = data[data['Date'] != '2025-05-10']
-            sample2 = data[data['Date'] == '2025-05-10']
-
-            sample1.drop(columns='Date', inplace=True)
-            sample2.drop(columns='Date', inplace=True)
-
-            gcm.auto.assign_causal_mechanisms(causal_model, data)
-
-            gcm.fit(causal_model, data)
-            print(data)
-            attribution_scores = gcm.distribution_change(causal_model,
-                                                        sample1,
-                                                        sample2,
-                                                        kpi,
-                                                        num_samples=2000,
-                                                        difference_estimation_func=lambda x1, x2 : np.mean(x2) - np.mean(x1)
-            )
-            
-            if "Refund Amount" in attribution_scores:
-                attribution_scores.pop('Refund Amount')
-            if "Settlement Amount" in attribution_scores:
-                attribution_scores.pop('Settlement Amount')
-            
-            attribution_scores = {k: abs(float(v)) for k, v in attribution_scores.items()}   
-
-            # Convert attribution scores to a more readable format
-            formatted_scores = "\n".join([f"{k}: {float(v):.2f}" for k,v in attribution_scores.items()])
-
-            # Craft a detailed prompt for GPT
-            prompt = f"""You are a financial analyst and data scientist specializing in payment systems and transaction analysis. 
-            I have attribution scores from a causal analysis of our payment system, showing how different factors contribute to changes in Refund Amount.
-
-            The scores represent the causal impact of each variable on refund amounts, where the magnitude shows the strength of the impact
-
-            Here are the attribution scores:
-            {formatted_scores}
-
-            Please provide a detailed business analysis that:
-            1. Identifies the most significant factors affecting refunds. Only include the top 2 factors. 
-            2. Explains what these relationships mean in business terms.
-            3. Suggests actionable recommendations based on these findings
-            4. Discusses potential implications for risk management and process optimization
-
-            Focus on practical insights that would be valuable for:
-            - Risk Management Teams
-            - Payment Operations
-            - Customer Service
-            - Business Strategy
-
-            Please structure your response in clear sections and use specific examples where possible.
-            These insights have to be given to CEO of pine labs so make sure there is no technical jargon. Also, do not include any actual attribution numbers. 
-            """
-
-            # Make the API call
-            client = OpenAI()
-            response_ = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a financial analyst and payment systems expert providing business insights."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            response_ = str(response_.choices[0].message.content)
-            return response_
-            
+            with timed("kpi_extraction"):
+                kpis = parse_kpis(await self.kpi_extraction(question), default=[DEFAULT_CAUSAL_KPI])
+            attribution = await self.attribute(merchant, kpis, causal_pool)
+            with timed("narrative"):
+                response = await self.causal_report({result.kpi: result.scores for result in attribution})
+
         elif classification == "insight":
             # return self.run_insight(question)
-            response = process_query(question,merchant)
-            return response['english_response']
+            response = (await process_query(question, merchant))['english_response']
+        else:
+            with timed("narrative"):
+                response = await self.fallback(question)
+        return {"classification": classification, "response": response, "attribution": attribution}
+
+    async def aquery_batch(self, items, causal_pool=None, max_concurrency=BATCH_MAX_CONCURRENCY):
+        """
+        Answer a list of (question, merchant) pairs concurrently.
+
+        Identical pairs are answered once, all questions are classified in a
+        single LLM call, and the insight/causal branches run concurrently with
+        at most `max_concurrency` in flight. Returns one dict per item, in
+        order, with the response or error, classification and timing.
+        """
+        started = time.perf_counter()
+        unique = list(dict.fromkeys(items))
+        with timed("classification"):
+            classifications = await self.classify_questions([question for question, _ in unique])
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(question, merchant):
+            async with semaphore:
+                start = time.perf_counter()
+                attribution = None
+                try:
+                    answer = await self.answer(question, merchant, causal_pool, classifications[question])
+                    response, attribution = answer["response"], answer["attribution"]
+                    error = None if response is not None else "Assistant returned no response"
+                except Exception as e:
+                    response, error = None, str(e)
+                return {
+                    "question": question,
+                    "merchant": merchant,
+                    "classification": classifications[question],
+                    "response": response,
+                    "success": error is None,
+                    "error": error,
+                    "attribution": [result.as_dict() for result in attribution] if attribution is not None else None,
+                    "elapsed_ms": (time.perf_counter() - start) * 1000,
+                }
+
+        answers = dict(zip(unique, await asyncio.gather(*(answer(q, m) for q, m in unique))))
+        results, seen = [], set()
+        for item in items:
+            result = dict(answers[item], deduplicated=item in seen)
+            seen.add(item)
+            results.append(result)
+        logger.info(f"Answered {len(items)} batch items ({len(unique)} unique) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return results
+
+    async def stream_query(self, question, merchant, causal_pool=None):
+        """
+        Streaming variant of `aquery`.
+
+        Yields ("stage", {...}) events as each pipeline step completes, then
+        ("token", text) events for the final narrative as the LLM produces it,
+        and a closing ("done", {...}) event.
+        """
+        with timed("classification"):
+            classification = await self.classify_question(question)
+        yield "stage", {"stage": "classified", "classification": classification}
+
+        if classification == "causal":
+            with timed("kpi_extraction"):
+                kpis = parse_kpis(await self.kpi_extraction(question), default=[DEFAULT_CAUSAL_KPI])
+            yield "stage", {"stage": "kpi_extracted", "kpis": kpis}
+            attribution = await self.attribute(merchant, kpis, causal_pool)
+            yield "stage", {"stage": "attributed", "attribution": [result.as_dict() for result in attribution]}
+            scores = {result.kpi: result.scores for result in attribution}
+            tokens = astream_chat(CAUSAL_REPORT_SYSTEM_PROMPT, self.causal_report_prompt(scores),
+                                  stage="causal_report", **CAUSAL_REPORT_OPTIONS)
+
+        elif classification == "insight":
+            insight = await generate_insight(question, merchant)
+            if insight is None:
+                yield "error", {"error": "Failed to load data"}
+                return
+            yield "stage", {"stage": "executed", "llm_code": insight["llm_code"], "code_cache_hit": insight["code_cache_hit"]}
+            tokens = stream_english_response(question, insight["result"])
+
         else:
-            return self.fallback(question)
\ No newline at end of file
+            tokens = astream_chat(FALLBACK_PROMPT, question, max_tokens=500, stage="fallback")
+
+        yield "stage", {"stage": "narrating"}
+        with timed("narrative"):
+            async for token in tokens:
+                yield "token", token
+        yield "done", {"classification": classification}
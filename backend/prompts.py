@@ -70,3 +70,26 @@ CLASSIFY_QUESTION_PROMPT = """
 
     Classify the following question:
 """
+
+
+CLASSIFY_QUESTIONS_BATCH_PROMPT = """
+    You are an expert at classifying questions into three categories: causal analysis, insight analysis, or other.
+
+    CLASSIFICATION RULES:
+    - "causal" if the question asks WHY something happened, seeks explanations, or investigates causes/reasons related to business/finance
+    - "insight" if the question asks WHAT/HOW MUCH/WHEN, seeks descriptive statistics, or requests data summaries related to business/finance
+    - "other" if the question is not related to business, finance, transactions, payments, or data analysis
+
+    RESPONSE FORMAT:
+    You will receive a numbered list of questions. Return ONLY a JSON array with one label per question, in the same order,
+    e.g. ["insight", "causal", "other"]. Do not add any other text.
+
+    EXAMPLES:
+    Questions:
+    1. Why did my refund amount increase yesterday?
+    2. How many transactions were processed last week?
+    3. Tell me a joke
+    Output: ["causal", "insight", "other"]
+
+    Classify the following questions:
+"""
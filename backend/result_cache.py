@@ -0,0 +1,78 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from .metrics import register_cache
+
+load_dotenv()
+
+# Memory budget for cached snippet results
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+def result_footprint(result):
+    """Approximate resident size of a snippet result in bytes"""
+    if isinstance(result, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = result.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    try:
+        return len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(result)
+
+
+def result_key(cleaned_code, merchant, dataset_version):
+    return (hashlib.sha256(cleaned_code.encode()).hexdigest(), merchant, dataset_version)
+
+
+class ResultCache:
+    """
+    LRU cache of executed snippet results keyed by (code hash, merchant,
+    dataset version), evicting least recently used entries once the summed
+    result footprint exceeds `max_bytes`. Results larger than the whole
+    budget are not cached.
+    """
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, result) on a hit, (False, None) on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def set(self, key, result):
+        size = result_footprint(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+
+result_cache = register_cache("result", ResultCache())
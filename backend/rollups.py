@@ -0,0 +1,111 @@
+import threading
+
+import pandas as pd
+
+from .dataset import get_dataset, iter_csv_chunks
+
+ROLLUP_KEYS = ['Merchant Display Name', 'Date']
+# Columns compute_rollups reads
+ROLLUP_COLUMNS = ROLLUP_KEYS + ['Refund Amount', 'Settlement Amount', 'Transaction Status Name']
+
+
+def compute_rollups(frame):
+    """
+    Aggregate raw transactions into one row per merchant x date holding the
+    additive pieces of the /get-cards-data KPIs (counts and sums only, so any
+    date window can be answered by summing rows).
+    """
+    keyed = frame[ROLLUP_KEYS].assign(
+        refund_sum=frame['Refund Amount'],
+        settlement_sum=frame['Settlement Amount'],
+        settlement_count=frame['Settlement Amount'].notna(),
+        captured=frame['Transaction Status Name'] == 'CAPTURED',
+    )
+    table = keyed.groupby(ROLLUP_KEYS, dropna=False, observed=True).agg(
+        transactions=('refund_sum', 'size'),
+        refund_sum=('refund_sum', 'sum'),
+        settlement_sum=('settlement_sum', 'sum'),
+        settlement_count=('settlement_count', 'sum'),
+        captured=('captured', 'sum'),
+    )
+    return table.sort_index()
+
+
+class KPIRollup:
+    """
+    Merchant x date KPI rollup kept in step with the dataset store.
+
+    When a new dataset version appears the rollup is refreshed incrementally:
+    only days from the last rolled-up day onwards are recomputed (the last day
+    may have been partial), on the assumption that exports append new days
+    rather than rewrite old ones.
+    """
+    def __init__(self):
+        self.table = None
+        self.version = None
+        self.path = None
+        self._lock = threading.Lock()
+
+    def get(self, handle=None):
+        """Return the rollup table for `handle` (default: the current dataset)"""
+        handle = handle or get_dataset()
+        if self.version != handle.version:
+            with self._lock:
+                if self.version != handle.version:
+                    self.refresh(handle)
+        return self.table
+
+    def refresh(self, handle):
+        frame = handle.frame
+        if frame is None:
+            # Out-of-core dataset: merchant x date partial sums are additive, so
+            # roll up each chunk and add them together
+            parts = [compute_rollups(chunk) for chunk in iter_csv_chunks(handle.path, ROLLUP_COLUMNS)]
+            table = pd.concat(parts).groupby(level=ROLLUP_KEYS, dropna=False, observed=True).sum().sort_index()
+        elif self.table is None or self.path != handle.path or self.table.empty:
+            table = compute_rollups(frame)
+        else:
+            last_day = self.table.index.get_level_values('Date').max()
+            kept = self.table[self.table.index.get_level_values('Date') < last_day]
+            fresh = compute_rollups(handle.between(start=last_day))
+            table = pd.concat([kept, fresh]).sort_index()
+        self.table = table
+        self.path = handle.path
+        self.version = handle.version
+
+
+_rollup = KPIRollup()
+
+
+def warm_rollups(handle=None):
+    """Build (or incrementally refresh) the rollup for `handle` ahead of requests"""
+    return _rollup.get(handle)
+
+
+def merchant_kpis(merchant, start_date=None, end_date=None, handle=None):
+    """
+    Answer the /get-cards-data KPIs for a merchant from the rollup table.
+
+    `start_date`/`end_date` are inclusive ISO dates; either may be omitted.
+    Work is proportional to the number of days in the window, not the number
+    of transactions.
+    """
+    table = _rollup.get(handle)
+    try:
+        days = table.xs(merchant, level='Merchant Display Name')
+    except KeyError:
+        days = table.iloc[0:0].droplevel('Merchant Display Name')
+    if start_date is not None:
+        days = days[days.index >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        days = days[days.index <= pd.Timestamp(end_date)]
+    totals = days.sum()
+
+    transactions = int(totals['transactions'])
+    settlement_count = totals['settlement_count']
+    return {
+        'totalTransactions': transactions,
+        'totalRefundAmount': abs(float(totals['refund_sum'])),
+        'averageSettlementAmount': float(totals['settlement_sum'] / settlement_count) if settlement_count else 0.0,
+        'successRate': float(totals['captured'] / transactions) if transactions else 0.0,
+    }
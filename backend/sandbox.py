@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", min(4, os.cpu_count() or 1)))
+SANDBOX_TIMEOUT_SECONDS = float(os.environ.get("SANDBOX_TIMEOUT_SECONDS", 20))
+# Extra address space a snippet may allocate on top of the worker's baseline
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", 2048))
+
+
+def _limit_memory(extra_mb):
+    """Cap the worker's address space at its current size plus `extra_mb` (Unix only)"""
+    try:
+        import resource
+        import psutil
+    except ImportError:
+        return
+    baseline = psutil.Process().memory_info().vms
+    limit = baseline + extra_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, memory_mb):
+    """
+    Worker loop: receive (code, merchant, fingerprint) jobs and send back the
+    result. The dataset comes from the store inherited from the zygote at fork
+    time (copy-on-write), or is loaded once when the platform cannot fork.
+    """
+    from .dataset import get_dataset, reload_dataset
+    from .execute_llm import execute_llm_code, load_data
+
+    get_dataset()
+    _limit_memory(memory_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        code, merchant, fingerprint = job
+        if fingerprint and get_dataset().fingerprint != fingerprint:
+            reload_dataset()
+        df = load_data(merchant=merchant)
+        result = execute_llm_code(code, df)
+        if result == "Execution error: MemoryError":
+            # The snippet hit the address-space cap of _limit_memory
+            result = f"Execution error: MemoryError (exceeded {memory_mb} MB)"
+        try:
+            conn.send(result)
+        except Exception:
+            # Unpicklable result objects are returned as their repr
+            conn.send(str(result))
+
+
+def _zygote_main(conn, memory_mb):
+    """
+    Zygote loop: load the dataset once, then fork a worker for each socket
+    received on `conn` and reply with its pid. The zygote is started fresh
+    (spawn) and runs no threads of its own, so forking it is safe at any time,
+    unlike forking the multi-threaded API process.
+    """
+    from .dataset import get_dataset
+    from .execute_llm import execute_llm_code  # noqa: F401  (imported once, before forking)
+
+    get_dataset()
+    # Workers are killed by pid from the API process; let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            fd = reduction.recv_handle(conn)
+        except EOFError:
+            return
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            conn.close()
+            try:
+                _worker_main(Connection(fd), memory_mb)
+            finally:
+                os._exit(0)
+        os.close(fd)
+        conn.send(pid)
+
+
+class _Zygote:
+    """A spawned process holding the loaded dataset that forks sandbox workers on request"""
+    def __init__(self, memory_mb):
+        self.conn, child_conn = multiprocessing.Pipe()
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(target=_zygote_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+
+    def fork(self, generation):
+        # A duplex Pipe is a Unix socket pair: send the worker's end to the zygote
+        conn, child_conn = multiprocessing.Pipe()
+        with self._lock:
+            reduction.send_handle(self.conn, child_conn.fileno(), self.process.pid)
+            child_conn.close()
+            pid = self.conn.recv()
+        return _Worker(conn, pid, generation)
+
+    def stop(self):
+        self.conn.close()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class _Worker:
+    def __init__(self, conn, pid, generation, process=None):
+        self.conn = conn
+        self.pid = pid
+        self.generation = generation
+        self.process = process
+
+    @classmethod
+    def spawn(cls, context, memory_mb, generation):
+        """A worker started directly, where the platform cannot fork"""
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn, memory_mb), daemon=True)
+        process.start()
+        child_conn.close()
+        return cls(conn, process.pid, generation, process)
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+        else:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pre-started worker processes that run LLM-written snippets out of the API process.
+
+    Workers are forked from a zygote: a process spawned at start that loads
+    the dataset once and forks a worker whenever one is needed, so workers
+    share the frame copy-on-write, and replacements are never forked from the
+    multi-threaded API process. Where fork is unavailable, workers are
+    spawned and load the dataset themselves. Each snippet runs under a
+    wall-clock deadline and an address-space cap; a worker that misses its
+    deadline is killed and replaced, and the caller gets an "Execution error"
+    result like any other failed snippet.
+    """
+    def __init__(self, size=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT_SECONDS, memory_mb=SANDBOX_MEMORY_MB):
+        self.size = size
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._can_fork = "fork" in multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("spawn")
+        self._zygote = None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._lost = 0  # workers killed in this generation that could not be replaced
+        self.waiting = 0
+        self.running = False
+
+    def start(self):
+        """Start the workers (call after the dataset has been loaded)"""
+        with self._lock:
+            if self.running:
+                return
+            if self._can_fork:
+                self._zygote = _Zygote(self.memory_mb)
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._lost = 0
+            self.running = True
+        logger.info(f"Sandbox pool ready with {self.size} workers ({'zygote' if self._zygote else 'spawn'})")
+
+    def shutdown(self):
+        with self._lock:
+            # Workers busy with a job right now are killed when they are handed back
+            self._generation += 1
+            self.running = False
+            while True:
+                try:
+                    self._idle.get_nowait().kill()
+                except queue.Empty:
+                    break
+            zygote, self._zygote = self._zygote, None
+        if zygote is not None:
+            zygote.stop()
+
+    def restart(self):
+        """Restart the zygote and workers, e.g. after a dataset reload, so they share the new frame"""
+        self.shutdown()
+        self.start()
+
+    @property
+    def idle(self):
+        """Workers free to take a snippet right now"""
+        return self._idle.qsize()
+
+    def _spawn(self):
+        zygote = self._zygote
+        if zygote is not None:
+            return zygote.fork(self._generation)
+        return _Worker.spawn(self._context, self.memory_mb, self._generation)
+
+    def _replace(self, generation):
+        """A new worker in place of a killed one, or None (logged and counted as lost) if it cannot start"""
+        try:
+            return self._spawn()
+        except Exception as e:
+            logger.error(f"Could not start a replacement sandbox worker: {e}")
+            with self._lock:
+                if generation == self._generation:
+                    self._lost += 1
+            return None
+
+    def _release(self, worker):
+        """Hand a live worker back to the pool, or kill it if the pool was restarted meanwhile"""
+        with self._lock:
+            if worker.generation == self._generation:
+                self._idle.put(worker)
+                return
+        worker.kill()
+
+    def _checkout(self):
+        """An idle worker, after retrying the replacement of lost ones; None if every worker is lost"""
+        with self._lock:
+            lost, self._lost = self._lost, 0
+            generation = self._generation
+        for _ in range(lost):
+            worker = self._replace(generation)
+            if worker is not None:
+                self._release(worker)
+        with self._lock:
+            if self._lost >= self.size:
+                return None
+        return self._idle.get()
+
+    def run(self, code, merchant=None, fingerprint=""):
+        """Blocking: execute a snippet in a worker and return its result"""
+        with self._lock:
+            self.waiting += 1
+        try:
+            worker = self._checkout()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if worker is None:
+            return "Execution error: no sandbox worker could be started"
+        replace = False
+        try:
+            worker.conn.send((code, merchant, fingerprint))
+            if worker.conn.poll(self.timeout):
+                return worker.conn.recv()
+            logger.warning(f"Snippet exceeded {self.timeout}s deadline; replacing worker {worker.pid}")
+            replace = True
+            return f"Execution error: timed out after {self.timeout:g}s"
+        except (EOFError, OSError) as e:
+            # The worker died (e.g. killed by the memory cap); replace it
+            replace = True
+            return f"Execution error: worker crashed ({e})"
+        finally:
+            if replace:
+                # Never hand the killed worker back, even if no replacement starts
+                worker.kill()
+                worker = self._replace(worker.generation)
+            if worker is not None:
+                self._release(worker)
+
+    async def execute(self, code, merchant=None, fingerprint=""):
+        """Execute a snippet in a worker without blocking the event loop"""
+        return await asyncio.to_thread(self.run, code, merchant, fingerprint)
+
+
+sandbox_pool = SandboxPool()
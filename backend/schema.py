@@ -0,0 +1,163 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .banks import ACQUIRER_COLUMN
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever SCHEMA or the row order changes, so columnar caches written
+# the old way are rebuilt (2: rows sorted by Date, 3: float64 amounts)
+SCHEMA_VERSION = 3
+
+# dtype of each column of the transaction export. Repetitive strings are
+# categoricals (one small code per row instead of a Python string), flags and
+# counts are small integers. Monetary amounts stay float64: float32 only has
+# about 7 significant digits, so amounts above ~₹65k would lose their paise.
+# Durations are float32. Columns not listed here keep pandas' inferred dtype.
+SCHEMA = {
+    'Merchant Display Name': 'category',
+    'Payment Mode Name': 'category',
+    'Transaction Status Name': 'category',
+    'Acquirer Response Code': 'category',
+    'Time To Complete': 'float32',
+    'Pine Payment Gateway Integration Mode Name': 'category',
+    'Refund Amount': 'float64',
+    'Settlement Amount': 'float64',
+    'Bank Commision': 'float64',
+    'Convenience Fees Amount In (Paise)': 'int32',
+    'Acquirer Issuer Match': 'int8',
+    'Payout Status': 'category',
+    'Bank Service Tax': 'float64',
+    'Amount To Be Deducted In Addition To Bank Charges': 'float64',
+}
+if ACQUIRER_COLUMN:
+    SCHEMA[ACQUIRER_COLUMN] = 'category'
+
+# Parsed once on load into datetime64 (ISO dates, optionally with a time)
+DATE_COLUMN = 'Date'
+
+# Integer columns holding missing values fall back to this dtype (float64, so
+# paise counts stay exact)
+INTEGER_FALLBACK = 'float64'
+
+
+class SchemaError(ValueError):
+    """The data does not fit the transaction schema"""
+
+
+def _is_integer(dtype):
+    return dtype != 'category' and np.dtype(dtype).kind == 'i'
+
+
+def csv_dtypes(columns=None):
+    """
+    dtype map for pd.read_csv, restricted to `columns`. Integer columns are
+    parsed as float64 so a missing value does not fail the read; `coerce`
+    narrows them afterwards.
+    """
+    return {column: 'float64' if _is_integer(dtype) else dtype
+            for column, dtype in SCHEMA.items() if columns is None or column in columns}
+
+
+def _coerce_integer(values, column, dtype):
+    if values.isna().any():
+        return values.astype(INTEGER_FALLBACK)
+    limits = np.iinfo(dtype)
+    numbers = values.to_numpy()
+    if len(numbers) and ((numbers % 1 != 0).any() or numbers.min() < limits.min or numbers.max() > limits.max):
+        raise SchemaError(f"{column} holds values that are not {dtype} integers")
+    return values.astype(dtype)
+
+
+def coerce(frame):
+    """
+    Cast the schema columns of `frame` to their dtypes and parse `Date`, in
+    place; returns the frame. Integer columns with missing values become
+    float64. Raises SchemaError if a column cannot be converted.
+    """
+    for column, dtype in SCHEMA.items():
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        try:
+            if _is_integer(dtype):
+                if not pd.api.types.is_integer_dtype(values) or values.dtype != dtype:
+                    frame[column] = _coerce_integer(values, column, dtype)
+            elif values.dtype != dtype:
+                frame[column] = values.astype(dtype)
+        except SchemaError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise SchemaError(f"{column} cannot be read as {dtype}: {e}") from e
+    if DATE_COLUMN in frame.columns and not pd.api.types.is_datetime64_dtype(frame[DATE_COLUMN]):
+        try:
+            frame[DATE_COLUMN] = pd.to_datetime(frame[DATE_COLUMN], format='ISO8601')
+        except (TypeError, ValueError) as e:
+            raise SchemaError(f"{DATE_COLUMN} holds values that are not ISO dates") from e
+    return frame
+
+
+def validate(frame, source="dataset"):
+    """
+    Raise SchemaError if a schema column of `frame` does not have its declared
+    dtype (or `Date` is not datetime64); log the schema columns it lacks.
+    """
+    wrong = []
+    for column, dtype in SCHEMA.items():
+        if column not in frame.columns:
+            continue
+        actual = frame[column].dtype
+        allowed = {dtype, INTEGER_FALLBACK} if _is_integer(dtype) else {dtype}
+        if not any(actual == expected for expected in allowed):
+            wrong.append(f"{column} is {actual}, expected {dtype}")
+    if DATE_COLUMN in frame.columns and not pd.api.types.is_datetime64_dtype(frame[DATE_COLUMN]):
+        wrong.append(f"{DATE_COLUMN} is {frame[DATE_COLUMN].dtype}, expected datetime64")
+    if wrong:
+        raise SchemaError(f"{source} does not match the schema: " + "; ".join(wrong))
+    missing = [column for column in [*SCHEMA, DATE_COLUMN] if column not in frame.columns]
+    if missing:
+        logger.warning(f"{source} lacks schema columns: {', '.join(missing)}")
+    return frame
+
+
+def read_csv(path, columns=None, chunk_rows=None):
+    """
+    pd.read_csv with the schema applied, parsing only `columns`. With
+    `chunk_rows`, returns an iterator of typed chunks of that many rows.
+    """
+    options = dict(usecols=columns, dtype=csv_dtypes(columns))
+    try:
+        if chunk_rows is None:
+            return coerce(pd.read_csv(path, **options))
+    except ValueError as e:
+        raise SchemaError(f"{path}: {e}") from e
+    return _read_csv_chunks(path, options, chunk_rows)
+
+
+def _read_csv_chunks(path, options, chunk_rows):
+    try:
+        for chunk in pd.read_csv(path, chunksize=chunk_rows, **options):
+            yield coerce(chunk)
+    except ValueError as e:
+        raise SchemaError(f"{path}: {e}") from e
+
+
+def concat(frames):
+    """
+    pd.concat for frames read separately (chunks, slices): categorical
+    columns get the union of the frames' categories, so they stay categorical
+    instead of falling back to object.
+    """
+    frames = list(frames)
+    if len(frames) > 1:
+        dtypes = {}
+        for column in frames[0].columns:
+            if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+                categories = union_categoricals([frame[column] for frame in frames]).categories
+                dtypes[column] = pd.CategoricalDtype(categories)
+        if dtypes:
+            frames = [frame.astype(dtypes) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from .metrics import collect_stages, replay_stages, timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CAUSAL_WORKERS = int(os.environ.get("CAUSAL_WORKERS", min(4, os.cpu_count() or 1)))
+# Causal jobs allowed to be running or waiting before new ones are rejected
+CAUSAL_MAX_PENDING = int(os.environ.get("CAUSAL_MAX_PENDING", 2 * CAUSAL_WORKERS))
+
+
+class QueueFullError(Exception):
+    """Raised when the causal pool already has its maximum number of pending jobs"""
+
+
+def _init_worker():
+    """Pre-warm a worker: import dowhy and load the dataset before the first job"""
+    from .causal import gcm  # noqa: F401
+    from .dataset import get_dataset
+    get_dataset()
+
+
+def _warm():
+    return os.getpid()
+
+
+def _run_attribution(merchant, kpis, fingerprint):
+    """
+    Worker entry point: run the causal attribution on the worker's dataset
+    copy. Returns (results, stage timings) so the API process can record them.
+    """
+    from .causal import attribute_distribution_change
+    from .dataset import get_dataset, reload_dataset
+    with collect_stages() as stages:
+        handle = get_dataset()
+        if fingerprint and handle.fingerprint != fingerprint:
+            with timed("data_load"):
+                handle = reload_dataset()
+        results = attribute_distribution_change(handle, merchant, kpis)
+    return results, stages
+
+
+class CausalPool:
+    """
+    Bounded process pool for the CPU-bound causal stage (gcm.fit and
+    gcm.distribution_change), so it never runs on the API event loop.
+
+    Workers are spawned and pre-warmed at startup. At most `max_pending` jobs
+    may be queued or running; beyond that `attribute` raises QueueFullError.
+    Each worker keeps its own fitted-model cache (share them across workers
+    with CAUSAL_CACHE_DIR).
+    """
+    def __init__(self, max_workers=CAUSAL_WORKERS, max_pending=CAUSAL_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        """Spawn the workers; each one imports dowhy and loads the dataset as it starts"""
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        # Submitting one task per worker makes the executor spawn all of them now
+        for future in [self._executor.submit(_warm) for _ in range(self.max_workers)]:
+            future.result()
+        logger.info(f"Causal pool ready with {self.max_workers} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def attribute(self, merchant, kpis, fingerprint=""):
+        """Run attribute_distribution_change in a worker and await its AttributionResults"""
+        if self._executor is None:
+            self.start()
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f"Causal analysis queue is full ({self.pending} pending jobs)")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            results, stages = await loop.run_in_executor(self._executor, _run_attribution, merchant, kpis, fingerprint)
+            replay_stages(stages)
+            return results
+        finally:
+            self.pending -= 1
+
+
+causal_pool = CausalPool()
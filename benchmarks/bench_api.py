@@ -0,0 +1,190 @@
+"""
+End-to-end throughput of the API on synthetic data with the LLM replaced by
+benchmarks.fake_openai. Starts the fake LLM server and the API (uvicorn) as
+subprocesses, then drives each scenario with `--concurrency` clients and
+reports throughput, p50/p99 latency and the peak RSS of the API process tree
+(sandbox and causal workers included).
+
+Scenarios: cards (/get-cards-data), insight (/query, generated snippet),
+causal (/query, causal attribution) and business-insights.
+
+    python -m benchmarks.bench_api --rows 1000000 --requests 200 --concurrency 16
+    python -m benchmarks.bench_api --scenario causal --requests 10 --latency-ms 500
+
+Settings of the API (SANDBOX_WORKERS, CAUSAL_WORKERS, LLM_CACHE_MAX_ENTRIES, ...)
+are taken from the environment, as in production.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import psutil
+
+from .synthetic import PAYMENT_MODES, write_transactions
+
+SCENARIOS = ["cards", "insight", "causal", "business-insights"]
+DATES = [f"2025-05-{day:02d}" for day in range(1, 17)]
+
+
+def scenario_request(scenario, i, merchants):
+    """(path, JSON body) of the i-th request of a scenario"""
+    merchant = f"Merchant {i % merchants}"
+    date = DATES[i % len(DATES)]
+    if scenario == "cards":
+        return "/get-cards-data", {"merchant": merchant, "start_date": DATES[0], "end_date": date}
+    if scenario == "insight":
+        mode = PAYMENT_MODES[i % len(PAYMENT_MODES)]
+        return "/query", {"question": f"What is the total refund amount for {mode} on {date}?", "merchant": merchant}
+    if scenario == "causal":
+        return "/query", {"question": "Why did the refund amount increase on 2025-05-10?", "merchant": merchant}
+    return "/business-insights", {"merchant": merchant}
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+
+class RssSampler:
+    """Samples the summed RSS of a process and its children in a background thread"""
+    def __init__(self, pid, interval=0.05):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rss(self):
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def run_scenario(base_url, scenario, requests, concurrency, merchants, timeout):
+    """
+    Send `requests` requests with `concurrency` in flight; returns (latencies,
+    errors, rejected, wall time), where `rejected` counts 503s from a full
+    causal queue
+    """
+    latencies, errors, rejected = [], 0, 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(scenario_request(scenario, i, merchants))
+
+    async def client(http):
+        nonlocal errors, rejected
+        while not queue.empty():
+            path, body = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await http.post(path, json=body)
+                status = response.status_code
+                ok = status == 200 and response.json().get("success", True)
+            except httpx.HTTPError:
+                status, ok = None, False
+            latencies.append(time.perf_counter() - start)
+            rejected += status == 503
+            errors += not ok and status != 503
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as http:
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+    return latencies, errors, rejected, time.perf_counter() - started
+
+
+def wait_until_up(url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--data", help="existing CSV to serve instead of generating one")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (repeatable, default all)")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=200, help="fake LLM latency per call")
+    parser.add_argument("--token-ms", type=float, default=5, help="fake LLM delay per streamed word")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--llm-port", type=int, default=8101)
+    parser.add_argument("--timeout", type=float, default=600, help="per-request and startup timeout in seconds")
+    parser.add_argument("--api-log", help="file for the API's log output (discarded by default)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = args.data
+        if data is None:
+            data = os.path.join(tmp, "data_cleaned.csv")
+            write_transactions(data, args.rows, args.merchants, spike_date="2025-05-10")
+
+        llm = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_openai", "--port", str(args.llm_port),
+                                "--latency-ms", str(args.latency_ms), "--token-ms", str(args.token_ms)])
+        env = dict(os.environ, DATA_PATH=data, OPENAI_API_KEY="bench",
+                   OPENAI_BASE_URL=f"http://127.0.0.1:{args.llm_port}/v1")
+        started = time.perf_counter()
+        log = open(args.api_log, "w") if args.api_log else subprocess.DEVNULL
+        api = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--port", str(args.port),
+                                "--log-level", "warning"], env=env, stdout=log, stderr=log)
+        try:
+            wait_until_up(f"http://127.0.0.1:{args.llm_port}/docs", llm, args.timeout)
+            wait_until_up(f"http://127.0.0.1:{args.port}/", api, args.timeout)
+            sampler = RssSampler(api.pid)
+            print(f"rows={args.rows if args.data is None else data} merchants={args.merchants} "
+                  f"concurrency={args.concurrency} llm latency={args.latency_ms:g}ms")
+            print(f"startup {time.perf_counter() - started:.1f}s, rss after startup {sampler.rss() / 2**20:.0f}MB")
+
+            for scenario in args.scenario or SCENARIOS:
+                with sampler:
+                    latencies, errors, rejected, wall = asyncio.run(run_scenario(
+                        f"http://127.0.0.1:{args.port}", scenario, args.requests, args.concurrency,
+                        args.merchants, args.timeout))
+                print(f"{scenario:<18} {len(latencies) / wall:8.1f} req/s  "
+                      f"p50={statistics.median(latencies) * 1000:8.1f}ms p99={_percentile(latencies, 0.99) * 1000:8.1f}ms  "
+                      f"peak rss={sampler.peak / 2**20:6.0f}MB  errors={errors} rejected={rejected}/{len(latencies)}")
+        finally:
+            for process in (api, llm):
+                process.terminate()
+                process.wait()
+            if args.api_log:
+                log.close()
+
+
+if __name__ == "__main__":
+    main()
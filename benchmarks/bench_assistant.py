@@ -0,0 +1,128 @@
+"""
+Per-question latency of the code-interpreter path against the mocked
+Assistants endpoints of benchmarks.fake_openai: creating an assistant and a
+thread, uploading the CSV, polling every second and deleting everything for
+each question (before) versus the AssistantPool, which reuses assistants and
+the upload and only opens a thread per question, polling with backoff (after).
+
+It then checks the pool's bookkeeping against the mock's live objects (see
+check_pool) and fails if an upload is not reused, a superseded upload is not
+deleted once released, or a thread or assistant is left behind.
+
+    python -m benchmarks.bench_assistant --rows 1000000 --questions 5 --run-ms 3000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from .bench_api import wait_until_up
+from .synthetic import write_transactions
+
+
+def check_pool(pool, base_url, data, questions):
+    """
+    Against the mock at `base_url`: questions on one dataset version share a
+    single upload; an upload superseded by a reload stays while a run holds
+    it and is deleted once released; every question's thread is deleted; and
+    shutdown leaves no assistant or file behind.
+    """
+    from backend.dataset import get_dataset, reload_dataset
+
+    def state():
+        return httpx.get(f"{base_url}/_state").json()
+
+    start = state()
+    for question in questions:
+        pool.ask(question)
+    now = state()
+    assert now["created"]["files"] - start["created"]["files"] == 1, "dataset uploaded more than once per version"
+    assert set(now["threads"]) <= set(start["threads"]), "a question's thread was not deleted"
+
+    with pool.session() as analyzer, pool.dataset_file(analyzer, get_dataset()) as old_file:
+        # A new dataset version while a run still holds the old upload
+        with open(data) as f:
+            last_line = f.readlines()[-1]
+        with open(data, "a") as f:
+            f.write(last_line)
+        reload_dataset()
+        pool.ask(questions[0])
+        assert old_file in state()["files"], "an upload still in use was deleted"
+    now = state()
+    assert old_file not in now["files"], "a superseded upload was not deleted once released"
+    assert now["created"]["files"] - start["created"]["files"] == 2, "the new dataset version was not uploaded once"
+    assert set(now["threads"]) <= set(start["threads"]), "a question's thread was not deleted"
+
+    pool.shutdown()
+    now = state()
+    assert set(now["assistants"]) <= set(start["assistants"]), "shutdown left an assistant behind"
+    assert set(now["files"]) <= set(start["files"]), "shutdown left a dataset upload behind"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake API latency per create call")
+    parser.add_argument("--run-ms", type=float, default=3000, help="time a run takes to complete")
+    parser.add_argument("--upload-mbps", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8102)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data_cleaned.csv")
+        write_transactions(data, args.rows)
+        size_mb = os.path.getsize(data) / 2**20
+        os.environ.update(DATA_PATH=data, OPENAI_API_KEY="bench", OPENAI_BASE_URL=f"http://127.0.0.1:{args.port}/v1")
+        # Imported after the environment points the clients and dataset at the benchmark
+        from backend.assistant import AssistantPool, DataAnalysisAssistant
+        from backend.dataset import get_dataset
+        get_dataset()
+
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_openai", "--port", str(args.port),
+                                   "--latency-ms", str(args.latency_ms), "--run-ms", str(args.run_ms),
+                                   "--upload-mbps", str(args.upload_mbps)])
+        try:
+            wait_until_up(f"http://127.0.0.1:{args.port}/docs", server, 60)
+            questions = [f"What was the refund trend for Merchant {i}?" for i in range(args.questions)]
+
+            before = []
+            for question in questions:
+                start = time.perf_counter()
+                analyzer = DataAnalysisAssistant(poll_initial=1.0, poll_max=1.0)
+                analyzer.create_assistant()
+                analyzer.create_thread()
+                analyzer.upload_file(data)
+                analyzer.ask_question(question, show_steps=False)
+                analyzer.cleanup()
+                before.append(time.perf_counter() - start)
+
+            pool = AssistantPool(size=1)
+            after = []
+            for question in questions:
+                start = time.perf_counter()
+                pool.ask(question)
+                after.append(time.perf_counter() - start)
+            pool.shutdown()
+
+            check_pool(AssistantPool(size=2), f"http://127.0.0.1:{args.port}", data, questions[:2])
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"rows={args.rows} ({size_mb:.0f}MB) "
+          f"questions={args.questions} run={args.run_ms:g}ms")
+    print("before (setup + upload + 1s polling per question): p50=%.0fms" % (statistics.median(before) * 1000))
+    print("after  (pooled assistant, cached upload, backoff): p50=%.0fms first=%.0fms"
+          % (statistics.median(after) * 1000, after[0] * 1000))
+    print("pool checks passed: one upload per dataset version, superseded uploads deleted once released, "
+          "threads deleted after each question")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Wall time and ranking agreement of the causal attribution stage: one
+fixed 2000-sample gcm.distribution_change run per KPI (before) versus one
+shared sampling pass over all KPIs, with 2000 samples and with the adaptive,
+chunked and early-stopping sample count (after), for the smallest merchant
+of synthetic data with a refund spike for UPI on the anomaly date. The
+fitted model is warmed first, so both timings cover attribution only.
+
+Fails unless the adaptive runs draw fewer samples than the fixed run and
+pick the same top factor for every KPI whose top factor is the same in all
+fixed runs. KPIs an adaptive run attributes nothing to (no upstream
+mechanism changed significantly, so any fixed-run leader is noise) are not
+compared.
+
+    python -m benchmarks.bench_attribution --rows 20000 --runs 3
+    python -m benchmarks.bench_attribution --kpi "Refund Amount" --kpi "Settlement Amount"
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from dowhy import gcm
+
+from backend.causal import (
+    ATTRIBUTION_CHUNK_SAMPLES,
+    ATTRIBUTION_MAX_SAMPLES,
+    CAUSAL_COLUMNS,
+    CAUSAL_KPIS,
+    ATTRIBUTION_PARALLELISM,
+    attribute_distribution_change,
+    get_causal_model,
+    mean_difference,
+    prepare_causal_data,
+    top_factors,
+)
+from backend.dataset import DatasetStore
+from .synthetic import inject_refund_spike, make_transactions
+
+# Samples per gcm.distribution_change call before adaptive attribution
+FIXED_SAMPLES = 2000
+
+
+def fixed_attribution(handle, merchant, kpi, anomaly_date, num_samples=FIXED_SAMPLES):
+    """The previous attribution: one gcm.distribution_change call per KPI"""
+    data = prepare_causal_data(handle.merchant(merchant, columns=CAUSAL_COLUMNS))
+    causal_model = get_causal_model(handle, merchant, data)
+    sample1 = data[data['Date'] != anomaly_date].drop(columns='Date')
+    sample2 = data[data['Date'] == anomaly_date].drop(columns='Date')
+    scores = gcm.distribution_change(causal_model, sample1, sample2, kpi, num_samples=num_samples,
+                                     difference_estimation_func=mean_difference)
+    return {k: abs(float(v)) for k, v in scores.items() if k not in CAUSAL_KPIS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--merchants", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--kpi", action="append", help="KPI to attribute (repeatable, default Refund Amount)")
+    parser.add_argument("--anomaly-date", default="2025-05-10")
+    parser.add_argument("--no-spike", action="store_true", help="attribute pure noise instead of an injected refund spike")
+    args = parser.parse_args()
+    kpis = args.kpi or ["Refund Amount"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_cleaned.csv")
+        frame = make_transactions(args.rows, args.merchants)
+        if not args.no_spike:
+            inject_refund_spike(frame, args.anomaly_date)
+        frame.to_csv(path, index=False)
+        store = DatasetStore(path)
+        handle = store.load()
+    merchant = frame["Merchant Display Name"].value_counts().idxmin()
+    get_causal_model(handle, merchant, prepare_causal_data(handle.merchant(merchant, columns=CAUSAL_COLUMNS)))
+
+    def fixed_run():
+        start = time.perf_counter()
+        results = [fixed_attribution(handle, merchant, kpi, args.anomaly_date) for kpi in kpis]
+        return time.perf_counter() - start, results
+
+    def shared_run(**kwargs):
+        start = time.perf_counter()
+        results = attribute_distribution_change(handle, merchant, kpis, args.anomaly_date, **kwargs)
+        return time.perf_counter() - start, results
+
+    fixed = [fixed_run() for _ in range(args.runs)]
+    shared = [shared_run(num_samples=FIXED_SAMPLES) for _ in range(args.runs)]
+    adaptive = [shared_run() for _ in range(args.runs)]
+
+    # KPIs whose fixed runs all agree on the top factor, with that factor
+    leaders = {}
+    for i, kpi in enumerate(kpis):
+        fixed_leaders = {top_factors(results[i], 1) for _, results in fixed}
+        if len(fixed_leaders) == 1:
+            leaders[kpi] = fixed_leaders.pop()
+    mismatches = [(result.kpi, top_factors(result.scores, 1)) for _, results in adaptive for result in results
+                  if result.kpi in leaders and any(result.scores.values())
+                  and top_factors(result.scores, 1) != leaders[result.kpi]]
+    samples = [results[0].num_samples for _, results in adaptive]
+
+    print(f"rows={args.rows} merchant={merchant} ({handle.merchant(merchant).shape[0]} rows) kpis={', '.join(kpis)} "
+          f"spike={not args.no_spike} runs={args.runs} chunk={ATTRIBUTION_CHUNK_SAMPLES} "
+          f"budget={ATTRIBUTION_MAX_SAMPLES} parallelism={ATTRIBUTION_PARALLELISM}")
+    print("before (fixed %d samples per KPI): p50=%.0fms" % (FIXED_SAMPLES, statistics.median(t for t, _ in fixed) * 1000))
+    print("after  (%d samples, shared pass): p50=%.0fms" % (FIXED_SAMPLES, statistics.median(t for t, _ in shared) * 1000))
+    print("after  (adaptive, shared pass):     p50=%.0fms samples p50=%d (min %d, max %d)"
+          % (statistics.median(t for t, _ in adaptive) * 1000, statistics.median(samples), min(samples), max(samples)))
+    print(f"fixed runs agree on the top factor of {', '.join(f'{k} ({v[0]})' for k, v in leaders.items()) or 'no KPI'}; "
+          f"{len(mismatches)} adaptive mismatches "
+          f"({sum(results[0].num_samples < ATTRIBUTION_MAX_SAMPLES for _, results in adaptive)}/{args.runs} "
+          f"runs stopped before the sample budget)")
+    for result in adaptive[-1][1]:
+        print(f"{result.kpi}:")
+        for factor in top_factors(result.scores, len(result.scores)):
+            low, high = result.intervals[factor]
+            print(f"  {factor:<52} {result.scores[factor]:10.3f}  [{low:.3f}, {high:.3f}]")
+
+    assert statistics.median(samples) < FIXED_SAMPLES, f"adaptive runs drew {statistics.median(samples)} samples"
+    assert not mismatches, f"adaptive top factors differ from the fixed run: {mismatches}"
+
+
+if __name__ == "__main__":
+    main()
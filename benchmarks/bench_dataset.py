@@ -0,0 +1,80 @@
+"""
+Per-request latency of the merchant slice used by /get-cards-data, /query and
+/business-insights: re-parsing the CSV on every request (before) versus reading
+from the process-wide dataset store (after). Also reports cold-start load time
+of the CSV parser versus the memory-mapped columnar cache.
+
+    python -m benchmarks.bench_dataset --rows 500000 --requests 20
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from backend.dataset import DatasetStore, build_columnar_cache, parse_csv, read_dataset
+from .synthetic import make_transactions
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(round(0.99 * (len(samples) - 1))))]
+    return statistics.median(samples) * 1000, p99 * 1000
+
+
+def per_request_csv(path, merchant):
+    df = pd.read_csv(path)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df[df['Merchant Display Name'] == merchant]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_cleaned.csv")
+        make_transactions(args.rows, args.merchants).to_csv(path, index=False)
+        merchants = [f"Merchant {i % args.merchants}" for i in range(args.requests)]
+
+        before = []
+        for merchant in merchants:
+            start = time.perf_counter()
+            per_request_csv(path, merchant)
+            before.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parse_csv(path)
+        csv_load = time.perf_counter() - start
+        start = time.perf_counter()
+        build_columnar_cache(path)
+        cache_build = time.perf_counter() - start
+        start = time.perf_counter()
+        read_dataset(path)
+        cache_load = time.perf_counter() - start
+
+        store = DatasetStore(path)
+        start = time.perf_counter()
+        store.load()
+        startup = time.perf_counter() - start
+        after = []
+        for merchant in merchants:
+            start = time.perf_counter()
+            store.get().merchant(merchant)
+            after.append(time.perf_counter() - start)
+
+    print(f"rows={args.rows} merchants={args.merchants} requests={args.requests}")
+    print("before (read_csv per request): p50=%.1fms p99=%.1fms" % _percentiles(before))
+    print("after  (shared dataset store): p50=%.1fms p99=%.1fms (one-off load %.1fms)"
+          % (*_percentiles(after), startup * 1000))
+    print("cold start: csv parse=%.1fms columnar cache=%.1fms (one-off build %.1fms)"
+          % (csv_load * 1000, cache_load * 1000, cache_build * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Prompt size of /business-insights per merchant size: the raw DataFrame repr
+interpolated into the prompt (before) versus the token-budgeted EDA summary
+(after), with the time to build each. The repr is truncated by pandas to a
+few rows and columns, so the tokens the same rows take as CSV are shown too.
+
+    python -m benchmarks.bench_eda --rows 10000 100000 1000000
+"""
+import argparse
+import time
+
+from backend.eda import EDA_TOKEN_BUDGET, budgeted_summary
+from backend.llm import count_tokens
+from backend.schema import coerce
+from .synthetic import make_transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="rows of a single merchant")
+    parser.add_argument("--date", default="2025-05-10")
+    parser.add_argument("--budget", type=int, default=EDA_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    print(f"budget={args.budget} tokens")
+    for rows in args.rows:
+        frame = coerce(make_transactions(rows, merchants=1))
+
+        start = time.perf_counter()
+        window = frame[frame['Date'] == args.date]
+        raw = str(window)
+        raw_ms = (time.perf_counter() - start) * 1000
+        full_tokens = count_tokens(window.to_csv(index=False))
+
+        start = time.perf_counter()
+        summary, tokens = budgeted_summary(frame, args.date, budget=args.budget)
+        summary_ms = (time.perf_counter() - start) * 1000
+
+        print(f"rows={rows:>9,} rows on date={len(window):>7,}  "
+              f"before: {count_tokens(raw):>5} tokens ({raw_ms:.0f}ms, truncated repr; {full_tokens:,} as CSV)  "
+              f"after: {tokens:>5} tokens ({summary_ms:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
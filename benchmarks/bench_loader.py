@@ -0,0 +1,127 @@
+"""
+Time and peak memory of loading one merchant's causal-stage slice (DAG
+columns, one week) from a large export: parsing the whole CSV and filtering
+afterwards (before) versus read_slice, which streams the CSV in chunks with
+the column projection and filters applied while reading, or filters the
+memory-mapped columnar cache (after). The startup cost of the in-memory and
+the out-of-core dataset store is shown too. Every variant runs in a fresh
+process, so its peak RSS is its own.
+
+    python -m benchmarks.bench_loader --rows 5000000 --merchants 200
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import pandas as pd
+
+from .synthetic import write_transactions
+
+
+def full_parse(path, merchant, start, end, columns):
+    """The previous path: parse every column of every row, then filter"""
+    df = pd.read_csv(path)
+    df['Date'] = pd.to_datetime(df['Date'])
+    df = df[(df['Merchant Display Name'] == merchant) & (df['Date'] >= start) & (df['Date'] <= end)]
+    return df[columns]
+
+
+def chunked_slice(path, merchant, start, end, columns):
+    from backend import dataset
+    dataset.USE_COLUMNAR_CACHE = False
+    return dataset.read_slice(path, [merchant], start, end, columns)
+
+
+def cached_slice(path, merchant, start, end, columns):
+    from backend.dataset import read_slice
+    return read_slice(path, [merchant], start, end, columns)
+
+
+def in_memory_store(path, *_):
+    from backend.dataset import DatasetStore
+    return DatasetStore(path, in_memory=True).load()
+
+
+def out_of_core_store(path, *_):
+    from backend.dataset import DatasetStore
+    return DatasetStore(path, in_memory=False).load()
+
+
+def idle(*_):
+    """Does nothing, for the baseline RSS of a worker process with pandas imported"""
+    return pd.DataFrame()
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process image. ru_maxrss survives exec on Linux, so it
+    would include the parent's peak; VmHWM does not.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(name, args, results):
+    start = time.perf_counter()
+    loaded = globals()[name](*args)
+    elapsed = time.perf_counter() - start
+    rows = len(loaded) if isinstance(loaded, pd.DataFrame) else loaded.rows
+    results.put((elapsed, peak_rss_mb(), rows))
+
+
+def measure(name, *args):
+    """(milliseconds, peak RSS in MB, rows) of running `name` in a fresh process"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(name, args, results))
+    process.start()
+    elapsed, peak, rows = results.get()
+    process.join()
+    return elapsed * 1000, peak, rows
+
+
+def report(label, result):
+    print("%-36s %7.0fms  peak rss %6.0fMB  %d rows" % (label, *result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--merchants", type=int, default=100)
+    parser.add_argument("--merchant", default="Merchant 1")
+    parser.add_argument("--start", default="2025-05-03")
+    parser.add_argument("--end", default="2025-05-10")
+    args = parser.parse_args()
+
+    from backend.causal import CAUSAL_COLUMNS
+    from backend.dataset import build_columnar_cache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_cleaned.csv")
+        write_transactions(path, args.rows, args.merchants)
+        print(f"rows={args.rows:,} merchants={args.merchants} csv={os.path.getsize(path) / 2**20:.0f}MB "
+              f"slice={args.merchant} {args.start}..{args.end}")
+        baseline = measure("idle")
+        slice_args = (path, args.merchant, pd.Timestamp(args.start), pd.Timestamp(args.end), CAUSAL_COLUMNS)
+
+        for label, name in [("before (parse all, then filter)", "full_parse"),
+                            ("after  (chunked CSV read_slice)", "chunked_slice")]:
+            report(label, measure(name, *slice_args))
+        build_columnar_cache(path)
+        report("after  (columnar cache read_slice)", measure("cached_slice", *slice_args))
+        report("store startup, in memory", measure("in_memory_store", path))
+        report("store startup, out of core", measure("out_of_core_store", path))
+        print(f"(an idle process with pandas imported peaks at {baseline[1]:.0f}MB)")
+
+
+if __name__ == "__main__":
+    main()
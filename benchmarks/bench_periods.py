@@ -0,0 +1,64 @@
+"""
+Latency of the time-period filters behind generated snippets and merchant
+windows: a boolean mask over every row of the unsorted frame (before) versus
+a binary search on the `Date`-sorted frame from the dataset store (after),
+for each period of `time_periods` on the whole dataset and on one merchant.
+
+    python -m benchmarks.bench_periods --rows 2000000 --merchants 100
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+
+from backend.dataset import DatasetStore, between_dates, filter_rows, parse_csv
+from backend.periods import time_periods
+from .synthetic import write_transactions
+
+
+def _median_ms(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def masked(frame, start, end):
+    """The previous filter: compare every row's date"""
+    return frame[frame['Date'].between(start, end)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--merchants", type=int, default=100)
+    parser.add_argument("--merchant", default="Merchant 1")
+    parser.add_argument("--today", default="2025-05-16")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_cleaned.csv")
+        write_transactions(path, args.rows, args.merchants)
+        unsorted = parse_csv(path)
+        handle = DatasetStore(path).load()
+
+    merchant_rows = handle.merchant_index[args.merchant]
+    print(f"rows={args.rows:,} merchants={args.merchants} today={args.today}")
+    for name, period in time_periods(date.fromisoformat(args.today)).items():
+        start, end = period["start"], period["end"]
+        rows = len(between_dates(handle.frame, start, end))
+        full = (_median_ms(lambda: masked(unsorted, start, end), args.repeat),
+                _median_ms(lambda: between_dates(handle.frame, start, end), args.repeat))
+        merchant = (_median_ms(lambda: filter_rows(handle.frame.take(merchant_rows), start=start, end=end), args.repeat),
+                    _median_ms(lambda: handle.merchant(args.merchant, start=start, end=end), args.repeat))
+        print(f"{name:<18} {rows:>9,} rows  all merchants: before {full[0]:7.1f}ms after {full[1]:7.2f}ms  "
+              f"{args.merchant}: before {merchant[0]:6.1f}ms after {merchant[1]:6.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Resident size of the transaction frame and the speed of the filters and
+groupbys the API runs on it, with pandas' default dtype inference (object
+strings, float64/int64; before) versus the dtypes of backend/schema.py
+(categoricals, int8/int32, float32 durations; after).
+
+    python -m benchmarks.bench_schema --rows 2000000 --merchants 200
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from backend.schema import read_csv
+from .synthetic import write_transactions
+
+
+def inferred_csv(path):
+    """The previous loader: default inference, `Date` parsed afterwards"""
+    df = pd.read_csv(path)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def _median_ms(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def operations(df):
+    """(label, callable) of the access patterns used by the pipeline and generated snippets"""
+    return [
+        ("merchant == filter", lambda: df[df['Merchant Display Name'] == 'Merchant 1']),
+        ("payment mode == filter", lambda: df[df['Payment Mode Name'] == 'UPI']),
+        ("status == CAPTURED share", lambda: (df['Transaction Status Name'] == 'CAPTURED').mean()),
+        ("groupby mode: refund sum", lambda: df.groupby('Payment Mode Name', observed=True)['Refund Amount'].sum()),
+        ("groupby merchant x date: size", lambda: df.groupby(['Merchant Display Name', 'Date'], observed=True).size()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--merchants", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data_cleaned.csv")
+        write_transactions(path, args.rows, args.merchants)
+
+        start = time.perf_counter()
+        before = inferred_csv(path)
+        before_load = time.perf_counter() - start
+        start = time.perf_counter()
+        after = read_csv(path)
+        after_load = time.perf_counter() - start
+
+    before_mb = before.memory_usage(deep=True).sum() / 2**20
+    after_mb = after.memory_usage(deep=True).sum() / 2**20
+    print(f"rows={args.rows:,} merchants={args.merchants}")
+    print(f"{'frame size':<32} before {before_mb:8.0f}MB  after {after_mb:8.0f}MB  ({before_mb / after_mb:.1f}x smaller)")
+    print(f"{'CSV load':<32} before {before_load * 1000:8.0f}ms  after {after_load * 1000:8.0f}ms")
+    for (label, slow), (_, fast) in zip(operations(before), operations(after)):
+        slow_ms, fast_ms = _median_ms(slow, args.repeat), _median_ms(fast, args.repeat)
+        print(f"{label:<32} before {slow_ms:8.1f}ms  after {fast_ms:8.1f}ms  ({slow_ms / fast_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
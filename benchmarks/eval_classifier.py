@@ -0,0 +1,111 @@
+"""
+Offline evaluation of the local question classifier against LLM labels.
+
+Reads a JSONL file of logged questions, one {"question": ..., "label": ...}
+object per line, where `label` is what CLASSIFY_QUESTION_PROMPT returned.
+Rows without a label are labelled by calling the LLM when --label-missing is
+given (which also reports LLM latency). Without a file, the examples from
+CLASSIFY_QUESTION_PROMPT are used.
+
+    python -m benchmarks.eval_classifier --questions logs/questions.jsonl
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+from backend.pipeline import call_openai_api, classify_locally
+from backend.prompts import CLASSIFY_QUESTION_PROMPT
+
+PROMPT_EXAMPLES = [
+    ("What is the avg refund amount for all transactions from 1st to 5th May?", "insight"),
+    ("Why did my refund amount increase yesterday?", "causal"),
+    ("What is the avg settlement for all transactions from 1st to 5th May?", "insight"),
+    ("Why did my settlement amount decrease yesterday?", "causal"),
+    ("How many transactions were processed last week?", "insight"),
+    ("What caused the spike in refunds on Monday?", "causal"),
+    ("Show me the top 10 customers by transaction volume", "insight"),
+    ("Why are customers requesting more refunds this month?", "causal"),
+    ("What is the weather like today?", "other"),
+    ("How do I cook pasta?", "other"),
+    ("What is the capital of France?", "other"),
+    ("Tell me a joke", "other"),
+]
+
+
+def load_questions(path):
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                rows.append((row["question"], row.get("label")))
+    return rows
+
+
+async def label_with_llm(rows):
+    """Fill in missing labels from the LLM, returning per-call latencies"""
+    labelled, latencies = [], []
+    for question, label in rows:
+        if label is None:
+            start = time.perf_counter()
+            label = (await call_openai_api(CLASSIFY_QUESTION_PROMPT, question)).strip().strip('"').lower()
+            latencies.append(time.perf_counter() - start)
+        labelled.append((question, label))
+    return labelled, latencies
+
+
+def evaluate(rows):
+    confusion = Counter()
+    latencies = []
+    covered = correct = 0
+    for question, label in rows:
+        start = time.perf_counter()
+        predicted = classify_locally(question)
+        latencies.append(time.perf_counter() - start)
+        if predicted is not None:
+            covered += 1
+            correct += predicted == label
+            confusion[(label, predicted)] += 1
+        else:
+            confusion[(label, "llm")] += 1
+    return {
+        "questions": len(rows),
+        "coverage": covered / len(rows) if rows else 0.0,
+        "accuracy_on_covered": correct / covered if covered else 0.0,
+        # Questions the local classifier passes on are answered by the LLM itself
+        "end_to_end_agreement": (correct + len(rows) - covered) / len(rows) if rows else 0.0,
+        "local_p50_us": statistics.median(latencies) * 1e6 if latencies else 0.0,
+        "local_max_us": max(latencies) * 1e6 if latencies else 0.0,
+        "confusion": confusion,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="JSONL file of {question, label} rows")
+    parser.add_argument("--label-missing", action="store_true", help="label rows without a label via the LLM")
+    args = parser.parse_args()
+
+    rows = load_questions(args.questions) if args.questions else list(PROMPT_EXAMPLES)
+    llm_latencies = []
+    if args.label_missing:
+        rows, llm_latencies = asyncio.run(label_with_llm(rows))
+    rows = [(q, label) for q, label in rows if label is not None]
+
+    report = evaluate(rows)
+    print(f"questions={report['questions']}")
+    print(f"coverage={report['coverage']:.1%} accuracy_on_covered={report['accuracy_on_covered']:.1%} "
+          f"end_to_end_agreement={report['end_to_end_agreement']:.1%}")
+    print(f"local latency p50={report['local_p50_us']:.1f}us max={report['local_max_us']:.1f}us")
+    if llm_latencies:
+        print(f"llm latency p50={statistics.median(llm_latencies) * 1000:.1f}ms over {len(llm_latencies)} calls")
+    print("confusion (label -> prediction):")
+    for (label, predicted), count in sorted(report["confusion"].items()):
+        print(f"  {label:>8} -> {predicted:<8} {count}")
+
+
+if __name__ == "__main__":
+    main()
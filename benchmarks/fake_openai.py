@@ -0,0 +1,275 @@
+"""
+Local stand-in for the OpenAI chat completions API, so the API can be
+benchmarked offline. Answers are canned per prompt (classification, KPI
+extraction, pandas snippet, narrative) and delayed by a configurable latency;
+streamed answers are sent word by word.
+
+The Assistants endpoints used by backend/assistant.py (assistants, files,
+threads, messages, runs) are mocked too: uploads take `--upload-mbps` and a
+run completes `--run-ms` after it is created. `GET /_state` lists the live
+assistants, files and threads and how many of each were ever created.
+
+    python -m benchmarks.fake_openai --port 8765 --latency-ms 300 --token-ms 5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench uvicorn api:app
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import re
+import time
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from .synthetic import PAYMENT_MODES
+
+# Set from the command line (or by an embedding benchmark) before serving
+LATENCY_MS = 200.0
+TOKEN_MS = 5.0
+NARRATIVE_WORDS = 150
+RUN_MS = 1500.0
+UPLOAD_MBPS = 50.0
+
+app = FastAPI(title="Fake OpenAI")
+
+WORDS = ("refunds settlement upi cards volume merchants increased decreased compared "
+         "previous week driven by failures issuer acquirer response timeouts recommend monitoring").split()
+
+
+def classify(question):
+    question = question.lower()
+    if question.startswith("why") or "what caused" in question:
+        return "causal"
+    if any(term in question for term in ("refund", "settle", "transaction", "payment", "upi", "amount")):
+        return "insight"
+    return "other"
+
+
+def snippet(question):
+    """A pandas snippet filtering on the date and payment mode named in the question"""
+    filters = []
+    date = re.search(r"\d{4}-\d{2}-\d{2}", question)
+    if date:
+        filters.append(f"(df['Date'] == '{date.group()}')")
+    mode = next((m for m in PAYMENT_MODES if m.lower() in question.lower()), None)
+    if mode:
+        filters.append(f"(df['Payment Mode Name'] == '{mode}')")
+    frame = f"df[{' & '.join(filters)}]" if filters else "df"
+    column = "Settlement Amount" if "settle" in question.lower() else "Refund Amount"
+    return f"```python\n{frame}.groupby('Payment Mode Name', observed=True)['{column}'].sum()\n```"
+
+
+def narrative(words=None):
+    words = NARRATIVE_WORDS if words is None else words
+    return " ".join(WORDS[i % len(WORDS)] for i in range(words))
+
+
+def answer(system, user, max_tokens=None):
+    """Canned answer for the prompt, recognised by its system message"""
+    if "numbered list of questions" in system:
+        questions = [line.split(". ", 1)[1] for line in user.splitlines() if ". " in line]
+        return json.dumps([classify(q) for q in questions])
+    if "classifying questions" in system:
+        return classify(user)
+    if "extracting Key Performance" in system:
+        return '"Refund Amount", "Settlement Amount"' if "settle" in user.lower() else '"Refund Amount"'
+    if "Python data-analyst" in system:
+        return snippet(user)
+    return narrative(min(NARRATIVE_WORDS, max_tokens) if max_tokens else None)
+
+
+def _usage(messages, content):
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    completion_tokens = len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body["messages"]
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    content = answer(system, messages[-1]["content"], body.get("max_tokens"))
+    created = int(time.time())
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def chunks():
+            def chunk(delta, finish_reason=None, **extra):
+                return "data: " + json.dumps({
+                    "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                    **extra,
+                }) + "\n\n"
+
+            for i, word in enumerate(content.split(" ")):
+                yield chunk({"content": word if i == 0 else " " + word})
+                await asyncio.sleep(TOKEN_MS / 1000)
+            yield chunk({}, "stop")
+            if include_usage:
+                yield chunk(None, usage=_usage(messages, content))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(messages, content),
+    }
+
+
+# Assistants API state: object id -> object
+_ids = itertools.count(1)
+assistants, files, threads, runs = {}, {}, {}, {}
+created = Counter()
+
+
+def _new_id(prefix):
+    return f"{prefix}_{next(_ids)}"
+
+
+def _deleted(object_id, kind):
+    return {"id": object_id, "object": f"{kind}.deleted", "deleted": True}
+
+
+def _run_view(run):
+    """The run as the API would return it now: in progress until RUN_MS after creation"""
+    done = time.time() >= run["completes_at"]
+    view = {k: v for k, v in run.items() if k not in ("completes_at", "answered")}
+    view["status"] = "completed" if done else "in_progress"
+    if done:
+        view["completed_at"] = int(run["completes_at"])
+        view["usage"] = {"prompt_tokens": 1200, "completion_tokens": 200, "total_tokens": 1400}
+    return view
+
+
+@app.post("/v1/assistants")
+async def create_assistant(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_MS / 1000)
+    assistant = {"id": _new_id("asst"), "object": "assistant", "created_at": int(time.time()),
+                 "name": body.get("name"), "model": body["model"], "instructions": body.get("instructions"),
+                 "tools": body.get("tools", []), "metadata": {}}
+    assistants[assistant["id"]] = assistant
+    created["assistants"] += 1
+    return assistant
+
+
+@app.delete("/v1/assistants/{assistant_id}")
+async def delete_assistant(assistant_id: str):
+    assistants.pop(assistant_id, None)
+    return _deleted(assistant_id, "assistant")
+
+
+@app.post("/v1/files")
+async def upload_file(request: Request):
+    size = len(await request.body())
+    await asyncio.sleep(LATENCY_MS / 1000 + size / (UPLOAD_MBPS * 2**20))
+    uploaded = {"id": _new_id("file"), "object": "file", "bytes": size, "created_at": int(time.time()),
+                "filename": "data_cleaned.csv", "purpose": "assistants", "status": "processed"}
+    files[uploaded["id"]] = uploaded
+    created["files"] += 1
+    return uploaded
+
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str):
+    files.pop(file_id, None)
+    return _deleted(file_id, "file")
+
+
+@app.post("/v1/threads")
+async def create_thread():
+    thread = {"id": _new_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}}
+    threads[thread["id"]] = dict(thread, messages=[])
+    created["threads"] += 1
+    return thread
+
+
+@app.delete("/v1/threads/{thread_id}")
+async def delete_thread(thread_id: str):
+    threads.pop(thread_id, None)
+    return _deleted(thread_id, "thread")
+
+
+def _message(thread_id, role, text, run_id=None):
+    return {"id": _new_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "run_id": run_id, "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "attachments": [], "metadata": {}}
+
+
+@app.post("/v1/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    body = await request.json()
+    message = _message(thread_id, body["role"], body["content"])
+    threads[thread_id]["messages"].append(message)
+    return message
+
+
+@app.get("/v1/threads/{thread_id}/messages")
+async def list_messages(thread_id: str):
+    thread = threads[thread_id]
+    for run in runs.values():
+        if run["thread_id"] == thread_id and time.time() >= run["completes_at"] and not run.get("answered"):
+            thread["messages"].append(_message(thread_id, "assistant", narrative(), run["id"]))
+            run["answered"] = True
+    data = list(reversed(thread["messages"]))
+    return {"object": "list", "data": data, "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None, "has_more": False}
+
+
+@app.post("/v1/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    body = await request.json()
+    assistant = assistants[body["assistant_id"]]
+    now = time.time()
+    run = {"id": _new_id("run"), "object": "thread.run", "created_at": int(now), "thread_id": thread_id,
+           "assistant_id": assistant["id"], "model": assistant["model"], "instructions": assistant["instructions"],
+           "tools": assistant["tools"], "status": "queued", "metadata": {}, "completes_at": now + RUN_MS / 1000}
+    runs[run["id"]] = run
+    return dict(_run_view(run), status="queued")
+
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}")
+async def retrieve_run(thread_id: str, run_id: str):
+    return _run_view(runs[run_id])
+
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}/steps")
+async def list_run_steps(thread_id: str, run_id: str):
+    return {"object": "list", "data": [], "first_id": None, "last_id": None, "has_more": False}
+
+
+@app.get("/_state")
+async def state():
+    """Live Assistants objects and creation counts, for benchmarks to check cleanup against"""
+    return {"assistants": list(assistants), "files": list(files), "threads": list(threads), "created": created}
+
+
+def main():
+    global LATENCY_MS, TOKEN_MS, NARRATIVE_WORDS, RUN_MS, UPLOAD_MBPS
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="delay before each answer")
+    parser.add_argument("--token-ms", type=float, default=TOKEN_MS, help="delay between streamed words")
+    parser.add_argument("--narrative-words", type=int, default=NARRATIVE_WORDS)
+    parser.add_argument("--run-ms", type=float, default=RUN_MS, help="time an Assistants run takes to complete")
+    parser.add_argument("--upload-mbps", type=float, default=UPLOAD_MBPS, help="file upload throughput")
+    args = parser.parse_args()
+    LATENCY_MS, TOKEN_MS, NARRATIVE_WORDS = args.latency_ms, args.token_ms, args.narrative_words
+    RUN_MS, UPLOAD_MBPS = args.run_ms, args.upload_mbps
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Synthetic transactions with the data_cleaned.csv schema.
+
+Write a CSV of any size (chunked, so 50M rows never sit in memory at once):
+
+    python -m benchmarks.synthetic --rows 50000000 --merchants 500 --out /tmp/data_cleaned.csv
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+PAYMENT_MODES = ["CREDIT/DEBIT CARD", "UPI", "NET BANKING", "WALLET", "EMI"]
+STATUSES = ["CAPTURED", "REFUNDED", "FAILED", "PENDING"]
+RESPONSE_CODES = ["AUTHORIZED", "0", "DECLINED", "TIMEOUT"]
+INTEGRATION_MODES = ["SEAMLESS", "REDIRECT"]
+PAYOUT_STATUSES = ["PAID", "PENDING"]
+# Rows generated and written per chunk by write_transactions
+CHUNK_ROWS = 1_000_000
+
+ACQUIRERS = ["AXIS BANK", "HDFC BANK LTD", "KOTAK MAHINDRA", "ICICI BANK", "IndusInd Bank",
+             "RBL BANK", "SCB", "YES BANK", "PNB", "IOB", "PAYTM PAYMENTS"]
+
+
+def make_transactions(rows=10_000, merchants=10, start="2025-04-01", end="2025-05-16", seed=0):
+    """Generate a DataFrame with the data_cleaned.csv schema"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, end, freq="D")
+
+    status = rng.choice(STATUSES, size=rows, p=[0.85, 0.08, 0.05, 0.02])
+    settlement = rng.gamma(2.0, 750.0, size=rows).round(2)
+    refund = np.where(status == "REFUNDED", -(settlement * rng.uniform(0.1, 1.0, size=rows)).round(2), 0.0)
+    commission = (settlement * rng.uniform(0.005, 0.02, size=rows)).round(2)
+
+    return pd.DataFrame({
+        "Merchant Display Name": rng.choice([f"Merchant {i}" for i in range(merchants)], size=rows),
+        "Payment Mode Name": rng.choice(PAYMENT_MODES, size=rows),
+        "Transaction Status Name": status,
+        "Acquirer Response Code": rng.choice(RESPONSE_CODES, size=rows, p=[0.7, 0.2, 0.07, 0.03]),
+        "Time To Complete": rng.exponential(12.0, size=rows).round(1),
+        "Pine Payment Gateway Integration Mode Name": rng.choice(INTEGRATION_MODES, size=rows),
+        "Refund Amount": refund,
+        "Settlement Amount": settlement,
+        "Bank Commision": commission,
+        "Convenience Fees Amount In (Paise)": rng.integers(0, 500, size=rows),
+        "Acquirer Issuer Match": rng.integers(0, 2, size=rows),
+        "Payout Status": rng.choice(PAYOUT_STATUSES, size=rows, p=[0.9, 0.1]),
+        "Bank Service Tax": (commission * 0.18).round(2),
+        "Amount To Be Deducted In Addition To Bank Charges": rng.uniform(0, 5, size=rows).round(2),
+        "Acquirer Name": rng.choice(ACQUIRERS, size=rows),
+        "Date": np.datetime_as_string(rng.choice(dates.values, size=rows), unit="D"),
+    })
+
+
+def inject_refund_spike(frame, anomaly_date, payment_mode="UPI", rate=0.6, seed=1):
+    """Refund a share of `payment_mode` transactions on `anomaly_date`, so there is a change to attribute"""
+    rng = np.random.default_rng(seed)
+    rows = (frame["Date"] == anomaly_date) & (frame["Payment Mode Name"] == payment_mode)
+    refunded = rows & (rng.uniform(size=len(frame)) < rate)
+    frame.loc[refunded, "Transaction Status Name"] = "REFUNDED"
+    frame.loc[refunded, "Refund Amount"] = -frame.loc[refunded, "Settlement Amount"]
+    return frame
+
+
+def write_transactions(path, rows, merchants=10, spike_date=None, chunk_rows=CHUNK_ROWS, seed=0):
+    """
+    Write `rows` synthetic transactions to a CSV at `path`, `chunk_rows` at a
+    time. With `spike_date`, each chunk gets a UPI refund spike on that day.
+    """
+    written = 0
+    for chunk in range(0, rows, chunk_rows):
+        frame = make_transactions(min(chunk_rows, rows - chunk), merchants, seed=seed + chunk // chunk_rows)
+        if spike_date is not None:
+            inject_refund_spike(frame, spike_date, seed=seed + chunk // chunk_rows)
+        frame.to_csv(path, mode="w" if chunk == 0 else "a", header=chunk == 0, index=False)
+        written += len(frame)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--spike-date", help="inject a UPI refund spike on this date (e.g. 2025-05-10)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="data/data_cleaned.csv")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = write_transactions(args.out, args.rows, args.merchants, args.spike_date, args.chunk_rows, args.seed)
+    print(f"wrote {rows:,} rows for {args.merchants} merchants to {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()